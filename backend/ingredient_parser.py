@@ -0,0 +1,245 @@
+"""Single-pass parser turning label text into a canonical ingredient tree.
+
+Handles nested sub-ingredient lists ("enriched flour (wheat flour, niacin,
+iron)"), "and/or" alternatives, "contains 2% or less of" qualifiers,
+percentages, E-numbers and common synonyms. Every ingredient gets a canonical
+key such as "red dye 40" for "FD&C Red No. 40" or "E129", so downstream
+caches and knowledge-base lookups can match on plain string equality.
+
+Normalizing a raw token is memoized in a bounded LRU. Labels repeat the same
+tokens constantly, so most tokens skip normalization entirely.
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import os
+import re
+
+from metrics import register_collector
+
+TOKEN_CACHE_SIZE = int(os.getenv("INGREDIENT_TOKEN_CACHE_SIZE", "65536"))
+
+OPENERS = {"(", "[", "{"}
+SEPARATORS = {",", ";"}
+
+# The scan jumps between structural characters; plain text is never walked
+# character by character in Python
+_STRUCTURE = re.compile(r"[,;()\[\]{}]|(?<!\S)and/or(?!\S)", re.IGNORECASE)
+
+# E-number -> canonical name, for additives the knowledge base knows about
+E_NUMBERS = {
+    "e102": "yellow 5",
+    "e110": "yellow 6",
+    "e129": "red dye 40",
+    "e133": "blue 1",
+    "e211": "sodium benzoate",
+    "e250": "sodium nitrite",
+    "e300": "ascorbic acid",
+    "e319": "tbhq",
+    "e320": "bha",
+    "e321": "bht",
+    "e322": "lecithin",
+    "e330": "citric acid",
+    "e338": "phosphoric acid",
+    "e407": "carrageenan",
+    "e441": "gelatin",
+    "e120": "carmine",
+    "e621": "monosodium glutamate",
+    "e951": "aspartame",
+}
+
+# Spellings of the same additive -> canonical name. Every harmful-ingredient
+# entry must stay reachable, so no entry's own name is rewritten here ("msg"
+# has its own entry and impact text).
+SYNONYMS = {
+    "hfcs": "high fructose corn syrup",
+    "glucose-fructose syrup": "high fructose corn syrup",
+    "red 40": "red dye 40",
+    "red no. 40": "red dye 40",
+    "fd&c red 40": "red dye 40",
+    "fd&c red no. 40": "red dye 40",
+    "red 40 lake": "red dye 40",
+    "allura red": "red dye 40",
+    "allura red ac": "red dye 40",
+    "fd&c yellow 5": "yellow 5",
+    "fd&c yellow no. 5": "yellow 5",
+    "yellow 5 lake": "yellow 5",
+    "tartrazine": "yellow 5",
+    "fd&c yellow 6": "yellow 6",
+    "fd&c yellow no. 6": "yellow 6",
+    "yellow 6 lake": "yellow 6",
+    "sunset yellow": "yellow 6",
+    "fd&c blue 1": "blue 1",
+    "fd&c blue no. 1": "blue 1",
+    "blue 1 lake": "blue 1",
+    "brilliant blue": "blue 1",
+    "butylated hydroxytoluene": "bht",
+    "butylated hydroxyanisole": "bha",
+    "tertiary butylhydroquinone": "tbhq",
+    "tert-butylhydroquinone": "tbhq",
+    "vitamin c": "ascorbic acid",
+    "cochineal": "carmine",
+}
+
+# Parenthesized class names that describe the parent rather than list
+# sub-ingredients, e.g. "bht (preservative)"
+DESCRIPTORS = {
+    "preservative", "preservatives", "color", "colour", "colors", "emulsifier", "emulsifiers",
+    "antioxidant", "antioxidants", "stabilizer", "stabilizers", "thickener", "thickeners",
+    "acidity regulator", "acidulant", "flavor enhancer", "sweetener", "sweeteners",
+    "leavening", "dough conditioner", "humectant", "anticaking agent",
+}
+
+_QUALIFIER = re.compile(
+    r"^(?:ingredients\s*:\s*)?"
+    r"(?:(?:contains|containing)\s+)?"
+    r"(?:(?:less\s+than\s+)?\d+(?:\.\d+)?\s*%\s+(?:or\s+less\s+)?of|less\s+than\s+\d+(?:\.\d+)?\s*%\s+of)"
+    r"(?:\s+each\s+of)?(?:\s+the\s+following)?\s*:?\s*"
+)
+_INGREDIENTS_PREFIX = re.compile(r"^ingredients\s*:\s*")
+_PERCENT = re.compile(r"\d+(?:\.\d+)?\s*%")
+_E_NUMBER = re.compile(r"^e\s?-?(\d{3,4}[a-z]?)$")
+_PURPOSE = re.compile(r"^(?:to|for|as)\s")
+_STRIP = " \t\r\n.*:†‡()[]{}"
+
+
+class Token(NamedTuple):
+    name: str
+    key: str
+    percent: Optional[float]
+
+
+@dataclass
+class IngredientNode:
+    name: str
+    key: str
+    percent: Optional[float] = None
+    children: List["IngredientNode"] = field(default_factory=list)
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def canonicalize(raw: str) -> Token:
+    """Normalize one raw token to (display name, canonical key, percent)"""
+    text = " ".join(raw.lower().split()).strip(_STRIP)
+    text = _QUALIFIER.sub("", text)
+    text = _INGREDIENTS_PREFIX.sub("", text)
+
+    percent = None
+    match = _PERCENT.search(text)
+    if match:
+        percent = float(match.group(0).rstrip("% "))
+        text = (text[:match.start()] + text[match.end():]).strip()
+    name = " ".join(text.split()).strip(_STRIP)
+
+    e_number = _E_NUMBER.match(name)
+    if e_number:
+        code = "e" + e_number.group(1)
+        key = E_NUMBERS.get(code, code)
+    else:
+        key = SYNONYMS.get(name, name)
+    return Token(name, key, percent)
+
+
+def _is_descriptor(token: Token) -> bool:
+    return token.key in DESCRIPTORS or bool(_PURPOSE.match(token.name))
+
+
+def parse_ingredients(text: str) -> List[IngredientNode]:
+    """Parse label text into a tree of canonical ingredient nodes"""
+    root: List[IngredientNode] = []
+    # Each level: (sibling list, parent node or None)
+    levels = [(root, None)]
+    buffer_start = 0
+    last_closed: Optional[IngredientNode] = None
+
+    def flush(end: int):
+        nonlocal last_closed
+        raw = text[buffer_start:end]
+        siblings, parent = levels[-1]
+        if last_closed is not None:
+            # Text trailing a parenthetical, e.g. "cheese (milk, salt) 12%"
+            token = canonicalize(raw)
+            if token.percent is not None and last_closed.percent is None:
+                last_closed.percent = token.percent
+            last_closed = None
+            return
+        if not raw.strip():
+            return
+        token = canonicalize(raw)
+        if parent is not None and token.percent is not None and not token.name:
+            parent.percent = token.percent
+        elif token.name and not (parent is not None and (_is_descriptor(token) or token.key == parent.key)):
+            siblings.append(IngredientNode(token.name, token.key, token.percent))
+
+    for match in _STRUCTURE.finditer(text):
+        char = match.group(0)
+        if char in SEPARATORS or len(char) > 1:
+            flush(match.start())
+            buffer_start = match.end()
+        elif char in OPENERS:
+            raw = text[buffer_start:match.start()]
+            siblings, _ = levels[-1]
+            if raw.strip():
+                token = canonicalize(raw)
+                node = IngredientNode(token.name, token.key, token.percent)
+                siblings.append(node)
+            elif last_closed is not None:
+                # "flour (wheat) (enriched)": keep adding to the same node
+                node = last_closed
+            else:
+                node = IngredientNode("", "")
+                siblings.append(node)
+            last_closed = None
+            levels.append((node.children, node))
+            buffer_start = match.end()
+        elif len(levels) > 1:
+            flush(match.start())
+            _, node = levels.pop()
+            last_closed = node
+            buffer_start = match.end()
+
+    flush(len(text))
+    # Unbalanced openers are closed implicitly at the end of the text
+    return _prune(root)
+
+
+def _prune(nodes: List[IngredientNode]) -> List[IngredientNode]:
+    """Drop nameless groups by hoisting their children"""
+    pruned = []
+    for node in nodes:
+        node.children = _prune(node.children)
+        if node.name:
+            pruned.append(node)
+        else:
+            pruned.extend(node.children)
+    return pruned
+
+
+def flatten(nodes: List[IngredientNode]) -> Iterator[IngredientNode]:
+    """Depth-first walk yielding every node, parents before their children"""
+    for node in nodes:
+        yield node
+        yield from flatten(node.children)
+
+
+def leaves(nodes: List[IngredientNode],
+           path: Tuple[IngredientNode, ...] = ()) -> Iterator[Tuple[IngredientNode, Tuple[IngredientNode, ...]]]:
+    """Yield (leaf, path from its top-level ingredient down to the leaf itself)
+
+    Leaves are what a label is actually made of: "enriched flour (wheat flour,
+    niacin)" yields wheat flour and niacin, each with enriched flour on its path.
+    """
+    for node in nodes:
+        node_path = path + (node,)
+        if node.children:
+            yield from leaves(node.children, node_path)
+        else:
+            yield node, node_path
+
+
+@register_collector
+def _token_cache_metrics():
+    info = canonicalize.cache_info()
+    yield "ingredient_token_cache_hits_total", "counter", "Ingredient token normalizations served from cache", info.hits
+    yield "ingredient_token_cache_misses_total", "counter", "Ingredient token normalizations computed", info.misses
+    yield "ingredient_token_cache_size", "gauge", "Entries in the ingredient token cache", info.currsize
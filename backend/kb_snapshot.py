@@ -0,0 +1,186 @@
+"""Compact binary snapshots of the ingredient knowledge base for on-device scoring.
+
+Layout (little-endian):
+
+    header   magic "GDKB", format u8, kind u8 (0 snapshot, 1 delta),
+             base version 8 bytes (zeros for snapshots), version 8 bytes
+    impacts  count u16, then per impact: length u16 + UTF-8
+    entries  count u32, then per entry sorted by name:
+             name length u8 + UTF-8, harmful score u8, allergen mask u16,
+             diet mask u16, impact index u16 (0xFFFF = none), flags u8
+    aliases  count u32, then per alias sorted: alias length u8 + UTF-8,
+             canonical name length u8 + UTF-8
+    removed  (deltas only) count u32, then per entry name: length u8 + UTF-8,
+             then the same for removed aliases
+
+The version is a content hash, so identical knowledge bases always produce
+identical snapshots and versions.
+
+To score a label the way the server does, a client lowercases each
+ingredient, collapses whitespace, rewrites "E 129" or "E-129" as "e129" and
+maps the result through the alias table. The harmful score is then the entry
+with exactly that name, else one whose name occurs within it. Allergen and
+diet masks are ORed over the FLAG_TRAIT entries found at word starts, longest
+first. A term flagged FLAG_PREFIX may end mid-word ("milk" in "milkfat");
+other terms must end on a word boundary. Trait entries with zero masks are
+exclusions: they shadow shorter terms, e.g. "coconut milk".
+"""
+from dataclasses import dataclass, field
+from hashlib import sha256
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import struct
+
+from ingredient_parser import E_NUMBERS, SYNONYMS
+from personalization import matches_as_prefix
+
+MAGIC = b"GDKB"
+FORMAT = 2
+KIND_SNAPSHOT = 0
+KIND_DELTA = 1
+NO_IMPACT = 0xFFFF
+
+# Entry flags
+FLAG_TRAIT = 1
+FLAG_PREFIX = 2
+
+_HEADER = struct.Struct("<4sBB8s8s")
+_ENTRY = struct.Struct("<BHHHB")
+
+
+class KnowledgeEntry(NamedTuple):
+    harmful_score: int
+    allergens: int
+    diet: int
+    impact: str
+    flags: int = 0
+
+
+@dataclass
+class KnowledgeBaseSnapshot:
+    version: str
+    entries: Dict[str, KnowledgeEntry]
+    data: bytes
+    aliases: Dict[str, str] = field(default_factory=dict)
+
+
+def entries_from_service(service) -> Dict[str, KnowledgeEntry]:
+    """Flatten harmful-ingredient and trait tables into one entry per term"""
+    entries = {}
+    for name in sorted(set(service.harmful_ingredients) | set(service.ingredient_traits)):
+        harmful = service.harmful_ingredients.get(name, {})
+        flags = 0
+        allergens, diet = 0, 0
+        if name in service.ingredient_traits:
+            allergens, diet = (int(mask) for mask in service.ingredient_traits[name])
+            flags = FLAG_TRAIT | (FLAG_PREFIX if matches_as_prefix(allergens, diet) else 0)
+        entries[name] = KnowledgeEntry(
+            harmful.get("score", 0), allergens, diet, harmful.get("impact", ""), flags
+        )
+    return entries
+
+
+def aliases_from_parser() -> Dict[str, str]:
+    """Synonym and E-number spellings the parser rewrites to canonical names"""
+    return {**SYNONYMS, **E_NUMBERS}
+
+
+def _pack_str(value: str, length_format: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return struct.pack(length_format, len(encoded)) + encoded
+
+
+def _encode_body(entries: Dict[str, KnowledgeEntry], aliases: Dict[str, str]) -> bytes:
+    impacts = sorted({entry.impact for entry in entries.values() if entry.impact})
+    impact_index = {impact: i for i, impact in enumerate(impacts)}
+
+    parts = [struct.pack("<H", len(impacts))]
+    parts.extend(_pack_str(impact, "<H") for impact in impacts)
+    parts.append(struct.pack("<I", len(entries)))
+    for name in sorted(entries):
+        entry = entries[name]
+        parts.append(_pack_str(name, "<B"))
+        parts.append(_ENTRY.pack(
+            entry.harmful_score, entry.allergens, entry.diet, impact_index.get(entry.impact, NO_IMPACT),
+            entry.flags,
+        ))
+    parts.append(struct.pack("<I", len(aliases)))
+    for alias in sorted(aliases):
+        parts.append(_pack_str(alias, "<B"))
+        parts.append(_pack_str(aliases[alias], "<B"))
+    return b"".join(parts)
+
+
+def build_snapshot(entries: Dict[str, KnowledgeEntry],
+                   aliases: Optional[Dict[str, str]] = None) -> KnowledgeBaseSnapshot:
+    aliases = aliases or {}
+    body = _encode_body(entries, aliases)
+    version = sha256(body).hexdigest()[:16]
+    header = _HEADER.pack(MAGIC, FORMAT, KIND_SNAPSHOT, bytes(8), bytes.fromhex(version))
+    return KnowledgeBaseSnapshot(version, entries, header + body, aliases)
+
+
+def _changes(base: dict, target: dict) -> Tuple[dict, List[str]]:
+    changed = {key: value for key, value in target.items() if base.get(key) != value}
+    return changed, sorted(set(base) - set(target))
+
+
+def build_delta(base: KnowledgeBaseSnapshot, target: KnowledgeBaseSnapshot) -> bytes:
+    """Entries and aliases added or changed since base, plus those removed"""
+    changed, removed = _changes(base.entries, target.entries)
+    changed_aliases, removed_aliases = _changes(base.aliases, target.aliases)
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT, KIND_DELTA, bytes.fromhex(base.version), bytes.fromhex(target.version)
+    )
+    parts = [header, _encode_body(changed, changed_aliases)]
+    for names in (removed, removed_aliases):
+        parts.append(struct.pack("<I", len(names)))
+        parts.extend(_pack_str(name, "<B") for name in names)
+    return b"".join(parts)
+
+
+def _read_str(data: bytes, offset: int, length_struct: struct.Struct) -> Tuple[str, int]:
+    (length,) = length_struct.unpack_from(data, offset)
+    offset += length_struct.size
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+
+
+def _decode_body(data: bytes, offset: int) -> Tuple[Dict[str, KnowledgeEntry], Dict[str, str], int]:
+    (impact_count,) = _U16.unpack_from(data, offset)
+    offset += _U16.size
+    impacts: List[str] = []
+    for _ in range(impact_count):
+        impact, offset = _read_str(data, offset, _U16)
+        impacts.append(impact)
+
+    (entry_count,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    entries = {}
+    for _ in range(entry_count):
+        name, offset = _read_str(data, offset, _U8)
+        score, allergens, diet, impact, flags = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        entries[name] = KnowledgeEntry(
+            score, allergens, diet, impacts[impact] if impact != NO_IMPACT else "", flags
+        )
+
+    (alias_count,) = _U32.unpack_from(data, offset)
+    offset += _U32.size
+    aliases = {}
+    for _ in range(alias_count):
+        alias, offset = _read_str(data, offset, _U8)
+        aliases[alias], offset = _read_str(data, offset, _U8)
+    return entries, aliases, offset
+
+
+def decode_snapshot(data: bytes) -> KnowledgeBaseSnapshot:
+    magic, fmt, kind, _, version = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or fmt != FORMAT or kind != KIND_SNAPSHOT:
+        raise ValueError("Not a knowledge-base snapshot")
+    entries, aliases, _ = _decode_body(data, _HEADER.size)
+    return KnowledgeBaseSnapshot(version.hex(), entries, data, aliases)
@@ -0,0 +1,333 @@
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Metrics are plain Python objects updated inline on the request path, so every
+operation is kept to a dict lookup, a bisect and a couple of additions.
+
+With several server workers each process has its own values. Set
+METRICS_MULTIPROC_DIR to a directory shared by the workers: each one then
+publishes its values there every METRICS_FLUSH_INTERVAL seconds, and whichever
+worker answers a scrape sums the files of all workers. Counters and histograms
+stay monotonic across worker restarts because files of exited workers are
+kept; gauges only count live workers. Other workers' values can lag by up to
+one flush interval.
+"""
+from bisect import bisect_left
+from glob import glob
+from time import perf_counter
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger("grocery_detective.timing")
+
+TIMING_LOGS = os.getenv("TIMING_LOGS", "").lower() in ("1", "true", "yes")
+
+
+def configure_timing_logs():
+    """Emit timing records as bare JSON lines on stderr at INFO
+
+    Neither the app nor uvicorn configures the root logger, whose default
+    WARNING level would otherwise drop every timing record.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+if TIMING_LOGS:
+    configure_timing_logs()
+
+MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+# Seconds. Covers sub-millisecond rule-engine work up to slow LLM round trips.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+REGISTRY = []
+COLLECTORS = []
+
+
+def _format_labels(labelnames, labels, extra=""):
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    __slots__ = ("name", "help", "labelnames", "_values")
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(values: dict, labels: tuple, value):
+        values[labels] = values.get(labels, 0) + value
+
+    def collect(self, values: dict = None):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in (self._values if values is None else values).items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    __slots__ = ("name", "help", "labelnames", "buckets", "_values")
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, labels: tuple = ()):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @staticmethod
+    def merge(values: dict, labels: tuple, value):
+        counts, total, count = value
+        state = values.get(labels)
+        if state is None:
+            values[labels] = [list(counts), total, count]
+            return
+        state[0] = [a + b for a, b in zip(state[0], counts)]
+        state[1] += total
+        state[2] += count
+
+    def collect(self, values: dict = None):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in (self._values if values is None else values).items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+def register_collector(collector):
+    """Register a callable yielding (name, type, help, value) samples at scrape time
+
+    type is "counter" or "gauge"; samples from several workers are summed.
+    """
+    COLLECTORS.append(collector)
+    return collector
+
+
+def _render_samples(samples):
+    """samples: name -> [type, help, value]"""
+    for name, (kind, help, value) in samples.items():
+        yield f"# HELP {name} {help}"
+        yield f"# TYPE {name} {kind}"
+        yield f"{name} {value}"
+
+
+def _local_samples():
+    return {name: [kind, help, value] for collector in COLLECTORS for name, kind, help, value in collector()}
+
+
+def render_latest() -> str:
+    if MULTIPROC_DIR:
+        return _render_multiprocess()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    lines.extend(_render_samples(_local_samples()))
+    return "\n".join(lines) + "\n"
+
+
+# ============= Multi-process Aggregation =============
+
+def write_snapshot():
+    """Publish this process's values to METRICS_MULTIPROC_DIR"""
+    if not MULTIPROC_DIR:
+        return
+    snapshot = {
+        "metrics": {metric.name: [[list(labels), value] for labels, value in metric._values.items()]
+                    for metric in REGISTRY},
+        "samples": _local_samples(),
+    }
+    path = os.path.join(MULTIPROC_DIR, f"{os.getpid()}.json")
+    # Readers must never see a half-written file
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _render_multiprocess() -> str:
+    write_snapshot()
+    metrics = {metric.name: metric for metric in REGISTRY}
+    values = {name: {} for name in metrics}
+    samples = {}
+    for path in glob(os.path.join(MULTIPROC_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, entries in snapshot["metrics"].items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            for labels, value in entries:
+                metric.merge(values[name], tuple(labels), value)
+        alive = _pid_alive(int(os.path.basename(path)[:-len(".json")]))
+        for name, (kind, help, value) in snapshot["samples"].items():
+            if kind == "gauge" and not alive:
+                continue
+            sample = samples.setdefault(name, [kind, help, 0])
+            sample[2] += value
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect(values[metric.name]))
+    lines.extend(_render_samples(samples))
+    return "\n".join(lines) + "\n"
+
+
+def reset_multiprocess_dir():
+    """Start a server run with an empty METRICS_MULTIPROC_DIR (call before forking workers)"""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for path in glob(os.path.join(MULTIPROC_DIR, "*.json*")):
+        os.remove(path)
+
+
+async def flush_periodically():
+    """Publish this worker's values every FLUSH_INTERVAL seconds until cancelled"""
+    try:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            write_snapshot()
+    finally:
+        write_snapshot()
+
+
+# ============= Application Metrics =============
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template, method and status",
+    ("route", "method", "status"),
+)
+
+STAGE_LATENCY = Histogram(
+    "stage_duration_seconds",
+    "Latency of individual processing stages",
+    ("stage",),
+)
+
+ANALYSIS_TOTAL = Counter(
+    "ingredient_analysis_total",
+    "Ingredient analyses by the engine that produced the result",
+    ("engine",),
+)
+
+LLM_PARSE_FAILURES = Counter(
+    "llm_parse_failures_total",
+    "LLM responses that could not be parsed or validated",
+    ("reason",),
+)
+
+CACHE_EVENTS = Counter(
+    "cache_events_total",
+    "Cache lookups by cache name and result",
+    ("cache", "result"),
+)
+
+
+class span:
+    """Time a block and record it under STAGE_LATENCY
+
+    Usage: ``with span("mongo_user_lookup"): ...``
+    """
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = perf_counter() - self.start
+        STAGE_LATENCY.observe(elapsed, (self.stage,))
+        if TIMING_LOGS:
+            logger.info(json.dumps({
+                "stage": self.stage,
+                "duration_ms": round(elapsed * 1000, 3),
+                "error": exc_type.__name__ if exc_type else None,
+            }))
+        return False
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording REQUEST_LATENCY per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - start
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded
+            route_path = route.path if route is not None else "unmatched"
+            REQUEST_LATENCY.observe(elapsed, (route_path, scope["method"], str(status_code)))
+            if TIMING_LOGS:
+                logger.info(json.dumps({
+                    "route": route_path,
+                    "method": scope["method"],
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 3),
+                }))
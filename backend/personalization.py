@@ -0,0 +1,205 @@
+"""Bitset encoding of allergens, diet conflicts and user preferences.
+
+Knowledge-base ingredients carry an Allergen mask and a DietFlag mask. A
+user's allergens, dietary restrictions and health goals compile once into the
+matching masks, so checking an ingredient against a profile is a bitwise AND
+however many restrictions the profile lists.
+
+Gluten is not one Allergen (wheat, barley, rye and malt all carry it), so a
+user allergic to gluten is matched against DietFlag.GLUTEN instead.
+"""
+from dataclasses import dataclass
+from enum import IntFlag
+from functools import lru_cache
+from typing import List, Tuple
+
+
+class Allergen(IntFlag):
+    MILK = 1 << 0
+    EGGS = 1 << 1
+    PEANUTS = 1 << 2
+    TREE_NUTS = 1 << 3
+    SOY = 1 << 4
+    WHEAT = 1 << 5
+    FISH = 1 << 6
+    SHELLFISH = 1 << 7
+    SESAME = 1 << 8
+    MUSTARD = 1 << 9
+    CELERY = 1 << 10
+    LUPIN = 1 << 11
+
+
+class DietFlag(IntFlag):
+    """What an ingredient is, as far as diets and health goals care"""
+    MEAT = 1 << 0
+    PORK = 1 << 1
+    FISH = 1 << 2
+    SHELLFISH = 1 << 3
+    DAIRY = 1 << 4
+    EGG = 1 << 5
+    SLAUGHTER_BYPRODUCT = 1 << 6
+    BEE_PRODUCT = 1 << 7
+    GLUTEN = 1 << 8
+    ALCOHOL = 1 << 9
+    ADDED_SUGAR = 1 << 10
+    HIGH_SODIUM = 1 << 11
+    REFINED_GRAIN = 1 << 12
+    TRANS_FAT = 1 << 13
+
+
+ALLERGEN_NAMES = {
+    Allergen.MILK: "milk",
+    Allergen.EGGS: "eggs",
+    Allergen.PEANUTS: "peanuts",
+    Allergen.TREE_NUTS: "tree nuts",
+    Allergen.SOY: "soy",
+    Allergen.WHEAT: "wheat",
+    Allergen.FISH: "fish",
+    Allergen.SHELLFISH: "shellfish",
+    Allergen.SESAME: "sesame",
+    Allergen.MUSTARD: "mustard",
+    Allergen.CELERY: "celery",
+    Allergen.LUPIN: "lupin",
+}
+
+# User-entered allergen labels (normalized) -> mask
+ALLERGEN_ALIASES = {
+    **{name: int(flag) for flag, name in ALLERGEN_NAMES.items()},
+    "dairy": Allergen.MILK,
+    "lactose": Allergen.MILK,
+    "egg": Allergen.EGGS,
+    "peanut": Allergen.PEANUTS,
+    "nuts": Allergen.PEANUTS | Allergen.TREE_NUTS,
+    "tree-nuts": Allergen.TREE_NUTS,
+    "soya": Allergen.SOY,
+    "seafood": Allergen.FISH | Allergen.SHELLFISH,
+}
+
+# Allergies to a DietFlag rather than an Allergen
+DIET_ALLERGEN_NAMES = {
+    DietFlag.GLUTEN: "gluten",
+}
+
+# User-entered allergen labels (normalized) -> DietFlag mask
+DIET_ALLERGEN_ALIASES = {
+    "gluten": DietFlag.GLUTEN,
+    "celiac": DietFlag.GLUTEN,
+    "coeliac": DietFlag.GLUTEN,
+}
+
+DIET_ALLERGEN_MASK = 0
+for _flag in DIET_ALLERGEN_NAMES:
+    DIET_ALLERGEN_MASK |= int(_flag)
+
+
+def matches_as_prefix(allergens: int, diet: int) -> bool:
+    """Whether an ingredient trait term may end mid-word
+
+    Allergen terms (and the exclusions that shadow them) also match as a word
+    prefix, so compounds such as "milkfat" or "sodium caseinate" are caught:
+    a missed allergen is worse than a false alarm. Diet-only terms need a
+    whole word, so "ham" stays out of "hamburger buns".
+    """
+    return bool(allergens or diet & DIET_ALLERGEN_MASK or not (allergens or diet))
+
+_ANIMAL = DietFlag.MEAT | DietFlag.PORK | DietFlag.FISH | DietFlag.SHELLFISH | DietFlag.SLAUGHTER_BYPRODUCT
+
+# Dietary restriction labels (normalized) -> conflicting DietFlags
+RESTRICTION_CONFLICTS = {
+    "vegan": _ANIMAL | DietFlag.DAIRY | DietFlag.EGG | DietFlag.BEE_PRODUCT,
+    "vegetarian": _ANIMAL,
+    "pescatarian": DietFlag.MEAT | DietFlag.PORK | DietFlag.SLAUGHTER_BYPRODUCT,
+    "gluten-free": DietFlag.GLUTEN,
+    "celiac": DietFlag.GLUTEN,
+    "dairy-free": DietFlag.DAIRY,
+    "lactose-free": DietFlag.DAIRY,
+    "halal": DietFlag.PORK | DietFlag.ALCOHOL,
+    "kosher": DietFlag.PORK | DietFlag.SHELLFISH,
+    "keto": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN,
+    "low-carb": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN,
+    "paleo": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN | DietFlag.DAIRY | DietFlag.GLUTEN,
+}
+
+# Health goal labels (normalized) -> conflicting DietFlags
+GOAL_CONFLICTS = {
+    "weight-loss": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN | DietFlag.TRANS_FAT,
+    "low-sugar": DietFlag.ADDED_SUGAR,
+    "diabetes": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN,
+    "blood-sugar-control": DietFlag.ADDED_SUGAR | DietFlag.REFINED_GRAIN,
+    "low-sodium": DietFlag.HIGH_SODIUM,
+    "heart-health": DietFlag.HIGH_SODIUM | DietFlag.TRANS_FAT,
+    "blood-pressure": DietFlag.HIGH_SODIUM,
+}
+
+
+def normalize_label(label: str) -> str:
+    return "-".join(label.lower().replace("_", " ").split())
+
+
+@dataclass(frozen=True)
+class PreferenceMask:
+    allergens: int
+    # DietFlags the user is allergic to, see DIET_ALLERGEN_ALIASES
+    diet_allergens: int
+    restrictions: int
+    goals: int
+    # (label, mask) pairs, only walked once an AND has already hit
+    restriction_labels: Tuple[Tuple[str, int], ...]
+    goal_labels: Tuple[Tuple[str, int], ...]
+
+    def restriction_conflicts(self, diet_flags: int) -> List[str]:
+        return [label for label, mask in self.restriction_labels if diet_flags & mask]
+
+    def goal_conflicts(self, diet_flags: int) -> List[str]:
+        return [label for label, mask in self.goal_labels if diet_flags & mask]
+
+
+@lru_cache(maxsize=4096)
+def _compile(allergens: Tuple[str, ...], restrictions: Tuple[str, ...], goals: Tuple[str, ...]) -> PreferenceMask:
+    allergen_mask = 0
+    diet_allergen_mask = 0
+    for label in allergens:
+        allergen_mask |= int(ALLERGEN_ALIASES.get(normalize_label(label), 0))
+        diet_allergen_mask |= int(DIET_ALLERGEN_ALIASES.get(normalize_label(label), 0))
+
+    restriction_labels = tuple(
+        (label, int(RESTRICTION_CONFLICTS[normalize_label(label)]))
+        for label in restrictions if normalize_label(label) in RESTRICTION_CONFLICTS
+    )
+    goal_labels = tuple(
+        (label, int(GOAL_CONFLICTS[normalize_label(label)]))
+        for label in goals if normalize_label(label) in GOAL_CONFLICTS
+    )
+
+    restriction_mask = 0
+    for _, mask in restriction_labels:
+        restriction_mask |= mask
+    goal_mask = 0
+    for _, mask in goal_labels:
+        goal_mask |= mask
+
+    return PreferenceMask(
+        allergen_mask, diet_allergen_mask, restriction_mask, goal_mask, restriction_labels, goal_labels
+    )
+
+
+def compile_preferences(preferences) -> PreferenceMask:
+    """Compile a UserPreferences into masks; identical profiles share one result"""
+    return _compile(
+        tuple(preferences.allergens),
+        tuple(preferences.dietary_restrictions),
+        tuple(preferences.health_goals),
+    )
+
+
+# Plain ints: IntFlag arithmetic is several times slower on the hot path
+_ALLERGEN_BITS = tuple((int(flag), name) for flag, name in ALLERGEN_NAMES.items())
+_DIET_ALLERGEN_BITS = tuple((int(flag), name) for flag, name in DIET_ALLERGEN_NAMES.items())
+
+
+def allergen_names(mask: int, diet_mask: int = 0) -> List[str]:
+    """Names for an Allergen mask plus a mask of DIET_ALLERGEN_NAMES flags"""
+    names = [name for bit, name in _ALLERGEN_BITS if mask & bit]
+    if diet_mask:
+        names.extend(name for bit, name in _DIET_ALLERGEN_BITS if diet_mask & bit)
+    return names
@@ -1,38 +1,169 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
 from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.datastructures import State
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, FrozenSet, Tuple
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import os
 import base64
 import asyncio
+import logging
+import time
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import json
+import orjson
+import re
+from functools import lru_cache
+
+import metrics as metrics_registry
+from metrics import (
+    ANALYSIS_TOTAL,
+    CACHE_EVENTS,
+    LLM_PARSE_FAILURES,
+    MetricsMiddleware,
+    flush_periodically,
+    render_latest,
+    span,
+)
+from ingredient_parser import flatten, leaves, parse_ingredients
+from kb_snapshot import (
+    KnowledgeBaseSnapshot,
+    aliases_from_parser,
+    build_delta,
+    build_snapshot,
+    decode_snapshot,
+    entries_from_service,
+)
+from personalization import Allergen, DietFlag, allergen_names, compile_preferences, matches_as_prefix
+from similarity import ProductSimilarityIndex, product_id_for
 
 load_dotenv()
 
-app = FastAPI(title="Grocery Detective API")
-
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger("grocery_detective")
 
 # MongoDB
-mongo_client = AsyncIOMotorClient(os.getenv("MONGO_URL"))
-db = mongo_client.grocery_detective
+MONGO_URL = os.getenv("MONGO_URL")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# /api/ready pings Mongo at most once per READY_PING_INTERVAL seconds and
+# reports not ready if the ping fails or takes longer than READY_PING_TIMEOUT
+READY_PING_INTERVAL = float(os.getenv("READY_PING_INTERVAL", "2"))
+READY_PING_TIMEOUT = float(os.getenv("READY_PING_TIMEOUT", "1"))
+
+# Responses smaller than this are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1024"))
+
+FREE_DAILY_SCAN_LIMIT = 5
+
+# Offline sync: scans accepted per request, concurrent analyses per request,
+# and history changes returned per response
+SYNC_MAX_BATCH = int(os.getenv("SYNC_MAX_BATCH", "50"))
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "200"))
+# Seconds after which a scan version that was allocated but never written is
+# treated as abandoned rather than still in flight
+SYNC_GAP_TIMEOUT = int(os.getenv("SYNC_GAP_TIMEOUT", "60"))
+
+# Snapshot and delta URLs always serve the current version; clients
+# revalidate hourly against the content-hash ETag
+KB_CACHE_CONTROL = "public, max-age=3600"
+KB_VERSION_PATTERN = re.compile(r"[0-9a-f]{16}")
+
+# Most recent scans loaded into the alternatives index at startup, and how
+# many are fetched and indexed per batch
+SIMILARITY_WARM_LIMIT = int(os.getenv("SIMILARITY_WARM_LIMIT", "100000"))
+SIMILARITY_WARM_BATCH_SIZE = int(os.getenv("SIMILARITY_WARM_BATCH_SIZE", "1000"))
 
 # PayPal Config
 PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
 PAYPAL_SECRET = os.getenv("PAYPAL_SECRET")
 PAYPAL_MODE = os.getenv("PAYPAL_MODE", "sandbox")
 
+# ============= Responses =============
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class MongoJSONResponse(ORJSONResponse):
+    """Render Mongo documents as-is, skipping jsonable_encoder and pydantic.
+
+    ObjectIds are stringified by orjson's default hook, so read-only routes can
+    return documents straight from the driver.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def product_analysis_response(analysis: "ProductAnalysis") -> Response:
+    """Serialize through the model's compiled pydantic-core serializer"""
+    return Response(analysis.model_dump_json(), media_type="application/json")
+
+
+# ============= Conditional Requests =============
+
+# Projection for the cheap per-user validator lookup
+USER_VERSION_PROJECTION = {"version": 1}
+
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+
+def bump_user_version(update: dict) -> dict:
+    """Add the per-user version bump to a Mongo update document.
+
+    Every write that changes what /users/{id} or /users/{id}/scans return must
+    go through this so cached ETags are invalidated.
+    """
+    update.setdefault("$inc", {})["version"] = 1
+    update.setdefault("$set", {})["updated_at"] = datetime.utcnow().isoformat()
+    return update
+
+
+def user_validators(user_meta: Optional[dict], etag_prefix: str) -> Dict[str, str]:
+    """ETag header derived from a user's version counter.
+
+    No Last-Modified is sent: it only has one-second precision, so two writes
+    within the same second would be indistinguishable to If-Modified-Since.
+    """
+    user_meta = user_meta or {}
+    return {
+        "ETag": f'W/"{etag_prefix}-v{user_meta.get("version", 0)}"',
+        "Cache-Control": CONDITIONAL_CACHE_CONTROL,
+    }
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Evaluate If-None-Match against the ETag; If-Modified-Since is ignored"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored
+    current = headers["ETag"].removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in if_none_match.split(","))
+
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    CACHE_EVENTS.inc(("conditional_get", "hit"))
+    return Response(status_code=304, headers=headers)
+
+
 # ============= Models =============
 
 class PyObjectId(ObjectId):
@@ -109,6 +240,18 @@ class SubscriptionRequest(BaseModel):
     plan_type: str
 
 
+class OfflineScan(BaseModel):
+    idempotency_key: str
+    ingredients_text: str
+    scanned_at: Optional[str] = None
+
+
+class SyncRequest(BaseModel):
+    user_id: str
+    scans: List[OfflineScan] = []
+    cursor: Optional[int] = None
+
+
 # ============= AI Analysis Service =============
 
 class AIAnalysisService:
@@ -131,18 +274,91 @@ class AIAnalysisService:
             'monosodium glutamate': {'score': 60, 'impact': 'Headaches, nausea'},
         }
         
-        self.common_allergens = [
-            'milk', 'eggs', 'peanuts', 'tree nuts', 'soy', 'wheat', 
-            'fish', 'shellfish', 'sesame', 'mustard', 'celery', 'lupin'
-        ]
+        A, D = Allergen, DietFlag
+        # term -> (allergens, diet flags), longest term first. (0, 0) entries
+        # exclude look-alikes such as "cocoa butter" or "eggplant"
+        self.ingredient_traits = {
+            'milk': (A.MILK, D.DAIRY), 'cream': (A.MILK, D.DAIRY), 'butter': (A.MILK, D.DAIRY),
+            'whey': (A.MILK, D.DAIRY), 'casein': (A.MILK, D.DAIRY), 'cheese': (A.MILK, D.DAIRY),
+            'lactose': (A.MILK, D.DAIRY), 'yogurt': (A.MILK, D.DAIRY), 'ghee': (A.MILK, D.DAIRY),
+            'buttermilk': (A.MILK, D.DAIRY), 'milkfat': (A.MILK, D.DAIRY), 'milk solids': (A.MILK, D.DAIRY),
+            'butterfat': (A.MILK, D.DAIRY), 'curds': (A.MILK, D.DAIRY),
+            'cocoa butter': (0, 0), 'shea butter': (0, 0), 'coconut milk': (0, 0), 'almond milk': (A.TREE_NUTS, 0),
+            'oat milk': (0, 0), 'rice milk': (0, 0), 'butternut': (0, 0), 'cream of tartar': (0, 0),
+            'egg': (A.EGGS, D.EGG), 'eggs': (A.EGGS, D.EGG), 'albumin': (A.EGGS, D.EGG), 'eggplant': (0, 0),
+            'peanut': (A.PEANUTS, 0), 'peanuts': (A.PEANUTS, 0), 'peanut butter': (A.PEANUTS, 0),
+            'tree nuts': (A.TREE_NUTS, 0), 'almond': (A.TREE_NUTS, 0), 'almonds': (A.TREE_NUTS, 0),
+            'cashew': (A.TREE_NUTS, 0), 'cashews': (A.TREE_NUTS, 0), 'walnut': (A.TREE_NUTS, 0),
+            'walnuts': (A.TREE_NUTS, 0), 'pecans': (A.TREE_NUTS, 0), 'hazelnut': (A.TREE_NUTS, 0),
+            'hazelnuts': (A.TREE_NUTS, 0), 'pistachios': (A.TREE_NUTS, 0),
+            'soy': (A.SOY, 0), 'soya': (A.SOY, 0), 'soybean': (A.SOY, 0), 'tofu': (A.SOY, 0),
+            'wheat': (A.WHEAT, D.GLUTEN), 'enriched flour': (A.WHEAT, D.GLUTEN | D.REFINED_GRAIN),
+            'white flour': (A.WHEAT, D.GLUTEN | D.REFINED_GRAIN), 'semolina': (A.WHEAT, D.GLUTEN),
+            'wheatgerm': (A.WHEAT, D.GLUTEN), 'durum': (A.WHEAT, D.GLUTEN), 'farina': (A.WHEAT, D.GLUTEN),
+            'couscous': (A.WHEAT, D.GLUTEN), 'spelt': (A.WHEAT, D.GLUTEN),
+            'barley': (0, D.GLUTEN), 'rye': (0, D.GLUTEN), 'malt': (0, D.GLUTEN), 'gluten': (0, D.GLUTEN),
+            'maltitol': (0, 0),
+            'fish': (A.FISH, D.FISH), 'anchovies': (A.FISH, D.FISH), 'salmon': (A.FISH, D.FISH),
+            'tuna': (A.FISH, D.FISH), 'cod': (A.FISH, D.FISH),
+            'shellfish': (A.SHELLFISH, D.SHELLFISH), 'shrimp': (A.SHELLFISH, D.SHELLFISH),
+            'crab': (A.SHELLFISH, D.SHELLFISH), 'lobster': (A.SHELLFISH, D.SHELLFISH), 'crab apple': (0, 0),
+            'sesame': (A.SESAME, 0), 'tahini': (A.SESAME, 0), 'mustard': (A.MUSTARD, 0),
+            'celery': (A.CELERY, 0), 'lupin': (A.LUPIN, 0),
+            'beef': (0, D.MEAT), 'chicken': (0, D.MEAT), 'turkey': (0, D.MEAT), 'meat': (0, D.MEAT),
+            'pork': (0, D.MEAT | D.PORK), 'bacon': (0, D.MEAT | D.PORK), 'ham': (0, D.MEAT | D.PORK),
+            'lard': (0, D.PORK | D.SLAUGHTER_BYPRODUCT), 'gelatin': (0, D.PORK | D.SLAUGHTER_BYPRODUCT),
+            'carmine': (0, D.SLAUGHTER_BYPRODUCT), 'cochineal': (0, D.SLAUGHTER_BYPRODUCT),
+            'rennet': (0, D.SLAUGHTER_BYPRODUCT),
+            'honey': (0, D.BEE_PRODUCT), 'beeswax': (0, D.BEE_PRODUCT),
+            'wine': (0, D.ALCOHOL), 'alcohol': (0, D.ALCOHOL), 'rum': (0, D.ALCOHOL), 'beer': (A.WHEAT, D.ALCOHOL | D.GLUTEN),
+            'sugar': (0, D.ADDED_SUGAR), 'cane sugar': (0, D.ADDED_SUGAR), 'corn syrup': (0, D.ADDED_SUGAR),
+            'high fructose corn syrup': (0, D.ADDED_SUGAR), 'dextrose': (0, D.ADDED_SUGAR),
+            'sucrose': (0, D.ADDED_SUGAR), 'glucose syrup': (0, D.ADDED_SUGAR), 'maltodextrin': (0, D.ADDED_SUGAR),
+            'salt': (0, D.HIGH_SODIUM), 'sea salt': (0, D.HIGH_SODIUM),
+            'monosodium glutamate': (0, D.HIGH_SODIUM), 'msg': (0, D.HIGH_SODIUM),
+            'partially hydrogenated': (0, D.TRANS_FAT),
+        }
+        self._traits_pattern = self._compile_traits_pattern(self.ingredient_traits)
+        # Both lookups depend only on the canonical ingredient key, so repeated
+        # ingredients are resolved once; personalization is then a mask AND
+        self.ingredient_trait_masks = lru_cache(maxsize=16384)(self._compute_trait_masks)
+        self.harmful_match = lru_cache(maxsize=16384)(self._match_harmful)
+
+    @staticmethod
+    def _compile_traits_pattern(traits):
+        """Alternation of all trait terms, longest first, each starting on a word boundary.
+
+        Terms end on a word boundary too unless matches_as_prefix allows them
+        to end mid-word.
+        """
+        alternatives = []
+        for term in sorted(traits, key=len, reverse=True):
+            prefix = matches_as_prefix(*traits[term])
+            alternatives.append(re.escape(term) + ("" if prefix else r"\b"))
+        return re.compile(r"\b(?:" + "|".join(alternatives) + ")")
+
+    def _match_harmful(self, key: str):
+        """Knowledge-base entry for an ingredient: exact key first, then substring"""
+        info = self.harmful_ingredients.get(key)
+        if info is not None:
+            return info
+        for harmful_name, info in self.harmful_ingredients.items():
+            if harmful_name in key:
+                return info
+        return None
+
+    def _compute_trait_masks(self, ingredient: str):
+        """OR together the (allergen, diet) masks of every trait term in an ingredient"""
+        allergens, diet = 0, 0
+        for match in self._traits_pattern.finditer(ingredient):
+            term_allergens, term_diet = self.ingredient_traits[match.group(0)]
+            allergens |= int(term_allergens)
+            diet |= int(term_diet)
+        return allergens, diet
 
     async def analyze_with_ai(self, ingredients_text: str, user_preferences: UserPreferences) -> ProductAnalysis:
         """Analyze ingredients using OpenAI GPT-4o"""
         try:
-            from emergentintegrations.llm.chat import LlmChat, UserMessage
-            
-            api_key = os.getenv("EMERGENT_LLM_KEY")
-            
             # Create system message for ingredient analysis
             system_message = f"""
 You are a professional nutritionist analyzing food ingredients. 
@@ -178,64 +394,123 @@ Format your response as JSON with this structure:
 }}
 """
             
+            response = await self._request_completion(system_message, ingredients_text)
+            
+            analysis = self._parse_llm_response(response)
+            ANALYSIS_TOTAL.inc(("ai",))
+            return analysis
+            
+        except Exception as e:
+            print(f"AI analysis error: {e}")
+            ANALYSIS_TOTAL.inc(("fallback",))
+            # Fallback to rule-based analysis
+            with span("fallback"):
+                return self.analyze_ingredients_fallback(ingredients_text, user_preferences)
+
+    async def _request_completion(self, system_message: str, ingredients_text: str) -> str:
+        """Send the analysis prompt to the LLM and return the raw response text"""
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+        
+        api_key = os.getenv("EMERGENT_LLM_KEY")
+        
+        with span("llm_client_init"):
             chat = LlmChat(
                 api_key=api_key,
                 session_id=f"analysis_{datetime.utcnow().timestamp()}",
                 system_message=system_message
             ).with_model("openai", "gpt-4o")
-            
-            user_message = UserMessage(
-                text=f"Analyze these ingredients:\n\n{ingredients_text}"
-            )
-            
-            response = await chat.send_message(user_message)
-            
-            # Parse JSON response
+        
+        user_message = UserMessage(
+            text=f"Analyze these ingredients:\n\n{ingredients_text}"
+        )
+        
+        with span("llm_call"):
+            return await chat.send_message(user_message)
+
+    def _parse_llm_response(self, response: str) -> ProductAnalysis:
+        """Strip markdown fences, decode JSON and validate into ProductAnalysis"""
+        with span("llm_parse"):
             response_text = response.strip()
             if response_text.startswith('```json'):
                 response_text = response_text[7:]
             if response_text.endswith('```'):
                 response_text = response_text[:-3]
             
-            analysis_data = json.loads(response_text.strip())
-            
-            return ProductAnalysis(**analysis_data)
-            
-        except Exception as e:
-            print(f"AI analysis error: {e}")
-            # Fallback to rule-based analysis
-            return self.analyze_ingredients_fallback(ingredients_text, user_preferences)
+            try:
+                analysis_data = json.loads(response_text.strip())
+            except ValueError:
+                LLM_PARSE_FAILURES.inc(("json",))
+                raise
+        
+        with span("llm_validate"):
+            try:
+                return ProductAnalysis(**analysis_data)
+            except (ValueError, TypeError):
+                LLM_PARSE_FAILURES.inc(("validation",))
+                raise
 
     def analyze_ingredients_fallback(self, ingredients_text: str, user_preferences: UserPreferences) -> ProductAnalysis:
-        """Fallback rule-based analysis"""
-        ingredients = [i.strip().lower() for i in ingredients_text.split(',')]
+        """Fallback rule-based analysis
+
+        Each leaf of the ingredient tree is scored once, so a group and its own
+        sub-ingredients are never both counted. A leaf takes its nearest
+        group's knowledge-base entry when it has none itself ("red 40 lake
+        (aluminum hydroxide)"), and the allergen and diet traits of every group
+        above it ("cheese (cultures, salt)" is dairy throughout).
+        """
+        ingredients = list(leaves(parse_ingredients(ingredients_text)))
+        profile = compile_preferences(user_preferences)
         
         analyzed_ingredients = []
         total_harmful_score = 0
-        concerns = []
+        # Ordered set: a concern shared by a group's sub-ingredients is reported once
+        concerns = {}
         health_benefits = []
+        restriction_conflicts = []
+        goal_conflicts = []
         
-        for ingredient in ingredients:
+        for node, path in ingredients:
+            ingredient = node.name
             harmful_score = 0
             health_impact = "No known issues"
             is_allergen = False
             warnings = []
             
-            # Check harmful ingredients
-            for harmful_name, info in self.harmful_ingredients.items():
-                if harmful_name in ingredient:
+            # Check harmful ingredients, nearest match on the path first
+            for source in reversed(path):
+                info = self.harmful_match(source.key)
+                if info is not None:
                     harmful_score = info['score']
                     health_impact = info['impact']
-                    concerns.append(f"{ingredient.title()}: {health_impact}")
+                    concerns[f"{source.name.title()}: {health_impact}"] = None
                     warnings.append(health_impact)
                     break
             
-            # Check allergens
-            for allergen in self.common_allergens:
-                if allergen in ingredient and allergen in [a.lower() for a in user_preferences.allergens]:
-                    is_allergen = True
+            # Check allergens, dietary restrictions and health goals
+            allergen_bits, diet_bits = self.ingredient_trait_masks(node.key)
+            for group in path[:-1]:
+                group_allergens, group_diet = self.ingredient_trait_masks(group.key)
+                allergen_bits |= group_allergens
+                diet_bits |= group_diet
+            user_allergens = allergen_bits & profile.allergens
+            user_diet_allergens = diet_bits & profile.diet_allergens
+            if user_allergens or user_diet_allergens:
+                is_allergen = True
+                for allergen in allergen_names(user_allergens, user_diet_allergens):
                     warnings.append(f"Contains {allergen.title()} - listed in your allergens")
-                    concerns.append(f"ALLERGEN WARNING: Contains {allergen.title()}")
+                    concerns[f"ALLERGEN WARNING: Contains {allergen.title()}"] = None
+            if diet_bits & profile.restrictions:
+                # Name the outermost ingredient that conflicts, e.g. the cheese
+                # rather than each of its sub-ingredients
+                source = next(n for n in path if self.ingredient_trait_masks(n.key)[1] & profile.restrictions)
+                for restriction in profile.restriction_conflicts(diet_bits):
+                    restriction_conflicts.append(restriction)
+                    warnings.append(f"Not suitable for your {restriction} diet")
+                    concerns[f"DIETARY CONFLICT: {source.name.title()} is not {restriction}"] = None
+            if diet_bits & profile.goals:
+                for goal in profile.goal_conflicts(diet_bits):
+                    goal_conflicts.append(goal)
+                    warnings.append(f"Works against your {goal} goal")
             
             analyzed_ingredients.append(
                 IngredientAnalysis(
@@ -262,12 +537,20 @@ Format your response as JSON with this structure:
             health_benefits.append("Moderate ingredient quality")
         else:
             recommendation = "not-recommended"
-            concerns.append("Contains multiple concerning ingredients")
+            concerns["Contains multiple concerning ingredients"] = None
         
         # Personalized advice
         advice_parts = []
         if any(i.is_allergen for i in analyzed_ingredients):
             advice_parts.append("⚠️ CONTAINS YOUR ALLERGENS - Avoid this product")
+        if restriction_conflicts:
+            advice_parts.append(
+                f"Not compatible with your dietary restrictions ({', '.join(dict.fromkeys(restriction_conflicts))})"
+            )
+        if goal_conflicts:
+            advice_parts.append(
+                f"Contains ingredients that work against your health goals ({', '.join(dict.fromkeys(goal_conflicts))})"
+            )
         if overall_score < 50:
             advice_parts.append("Consider healthier alternatives with fewer additives")
         if not concerns:
@@ -280,57 +563,115 @@ Format your response as JSON with this structure:
             recommendation=recommendation,
             ingredients=analyzed_ingredients,
             health_benefits=health_benefits,
-            concerns=concerns,
+            concerns=list(concerns),
             personalized_advice=personalized_advice
         )
 
 
-ai_service = AIAnalysisService()
+def ingredient_keys(ingredients_text: str) -> FrozenSet[str]:
+    """Canonical ingredient keys used as similarity-index features"""
+    return frozenset(node.key for node in flatten(parse_ingredients(ingredients_text)))
 
 
 # ============= API Routes =============
 
-@app.get("/api")
+router = APIRouter()
+
+
+# Per-application resources are opened by the lifespan and hung off
+# app.state (see create_app), so several apps can share one process
+
+def get_state(request: Request) -> State:
+    return request.app.state
+
+
+def get_db(request: Request):
+    return request.app.state.db
+
+
+@router.get("/api")
 async def root():
     return {"message": "Grocery Detective API", "version": "1.0.0"}
 
 
-@app.post("/api/users")
-async def create_user(user: User):
+@router.get("/api/ready")
+async def ready(state: State = Depends(get_state)):
+    """Readiness probe: 503 while Mongo is unreachable
+
+    Every route needs the database, so that is what can fail while the process
+    is serving. The ping result is cached for READY_PING_INTERVAL seconds so
+    frequent probes don't each cost a round trip. The alternatives index
+    loads in the background and doesn't affect readiness.
+    """
+    now = time.monotonic()
+    if now - state.db_pinged_at >= READY_PING_INTERVAL:
+        try:
+            await asyncio.wait_for(state.db.command("ping"), READY_PING_TIMEOUT)
+            state.db_reachable = True
+        except Exception:
+            state.db_reachable = False
+        state.db_pinged_at = now
+    if not state.db_reachable:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"ready": True}
+
+
+@router.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus exposition of request, stage and analysis metrics
+
+    Summed over all workers when METRICS_MULTIPROC_DIR is set (see metrics.py).
+    """
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+
+@router.post("/api/users")
+async def create_user(user: User, db=Depends(get_db)):
     """Create a new user"""
     user_dict = user.dict()
-    result = await db.users.insert_one(user_dict)
-    user_dict["_id"] = str(result.inserted_id)
-    return user_dict
+    user_dict["version"] = 0
+    user_dict["updated_at"] = user_dict["created_at"]
+    await db.users.insert_one(user_dict)
+    return MongoJSONResponse(user_dict)
 
 
-@app.get("/api/users/{user_id}")
-async def get_user(user_id: str):
+@router.get("/api/users/{user_id}")
+async def get_user(user_id: str, request: Request, db=Depends(get_db)):
     """Get user by ID"""
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
+    etag_prefix = f"user-{user_id}"
+    if has_conditional_headers(request):
+        # Answer revalidations from the version counter alone
+        user_meta = await db.users.find_one({"_id": ObjectId(user_id)}, USER_VERSION_PROJECTION)
+        if not user_meta:
+            raise HTTPException(status_code=404, detail="User not found")
+        headers = user_validators(user_meta, etag_prefix)
+        if is_not_modified(request, headers):
+            return not_modified_response(headers)
+        CACHE_EVENTS.inc(("conditional_get", "miss"))
+    
     user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user["_id"] = str(user["_id"])
-    return user
+    return MongoJSONResponse(user, headers=user_validators(user, etag_prefix))
 
 
-@app.post("/api/users/preferences")
-async def update_preferences(request: UpdatePreferencesRequest):
+@router.post("/api/users/preferences")
+async def update_preferences(request: UpdatePreferencesRequest, db=Depends(get_db)):
     """Update user preferences"""
     if not ObjectId.is_valid(request.user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
     result = await db.users.update_one(
         {"_id": ObjectId(request.user_id)},
-        {"$set": {
+        bump_user_version({"$set": {
             "preferences.dietary_restrictions": request.dietary_restrictions,
             "preferences.allergens": request.allergens,
             "preferences.health_goals": request.health_goals
-        }}
+        }})
     )
     
     if result.modified_count == 0:
@@ -339,72 +680,380 @@ async def update_preferences(request: UpdatePreferencesRequest):
     return {"success": True, "message": "Preferences updated"}
 
 
-@app.post("/api/analyze-ingredients")
-async def analyze_ingredients(request: AnalyzeIngredientsRequest):
-    """Analyze ingredients using AI"""
-    if not ObjectId.is_valid(request.user_id):
-        raise HTTPException(status_code=400, detail="Invalid user ID")
-    
-    # Get user
-    user = await db.users.find_one({"_id": ObjectId(request.user_id)})
+async def load_user_for_scan(db, user_id: str) -> dict:
+    """Fetch a user and reset their daily scan count on a new day"""
+    with span("mongo_user_lookup"):
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check scan limits for free users
     today = datetime.utcnow().date().isoformat()
     if user.get("last_scan_date") != today:
+        with span("mongo_scan_limit_reset"):
+            await db.users.update_one(
+                {"_id": ObjectId(user_id)},
+                bump_user_version({"$set": {"scans_today": 0, "last_scan_date": today}})
+            )
+        user["scans_today"] = 0
+    return user
+
+
+def scans_remaining(user: dict) -> Optional[int]:
+    """Scans left today, or None when unlimited"""
+    if user.get("is_premium", False):
+        return None
+    return max(0, FREE_DAILY_SCAN_LIMIT - user.get("scans_today", 0))
+
+
+async def allocate_scan_versions(db, user_id: str, count: int) -> range:
+    """Atomically reserve the next `count` per-user scan versions.
+
+    Versions are the /api/sync cursor. Each one is written in the same
+    insert_one as its scan, so a scan is never visible without its version.
+    """
+    user = await db.users.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$inc": {"scan_seq": count}},
+        projection={"scan_seq": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return range(user["scan_seq"] - count + 1, user["scan_seq"] + 1)
+
+
+async def analyze_and_insert_scan(state: State, user_id: str, ingredients_text: str, preferences: UserPreferences,
+                                  **extra) -> Tuple[ProductAnalysis, dict]:
+    """Analyze ingredients and insert the scan document; returns (analysis, scan)"""
+    with span("analysis"):
+        analysis = await state.ai_service.analyze_with_ai(ingredients_text, preferences)
+    
+    with span("mongo_scan_insert"):
+        # Allocated only once analysis is done, keeping the window between
+        # allocation and insert (an in-flight gap for sync) short
+        (version,) = await allocate_scan_versions(state.db, user_id, 1)
+        now = datetime.utcnow().isoformat()
+        scan_data = {
+            "user_id": user_id,
+            "ingredients_text": ingredients_text,
+            "analysis": analysis.model_dump(),
+            "created_at": now,
+            "version": version,
+            "versioned_at": now,
+            **extra,
+        }
+        await state.db.scans.insert_one(scan_data)
+    
+    state.similarity_index.add(
+        ingredient_keys(ingredients_text),
+        analysis.overall_score,
+        analysis.recommendation,
+        ingredients_text,
+    )
+    return analysis, scan_data
+
+
+async def commit_scans(db, user_id: str, count: int):
+    """Count newly inserted scans against the user and invalidate cached history.
+
+    The ETag version bump comes after the inserts so a history response is
+    never tagged with a version newer than its data.
+    """
+    with span("mongo_scan_count_update"):
         await db.users.update_one(
-            {"_id": ObjectId(request.user_id)},
-            {"$set": {"scans_today": 0, "last_scan_date": today}}
+            {"_id": ObjectId(user_id)},
+            bump_user_version({"$inc": {"scans_today": count}}),
         )
-        user["scans_today"] = 0
+
+
+async def backfill_scan_versions(db, user_id: str):
+    """Give scans stored before sync existed a version, oldest first"""
+    legacy = await db.scans.find(
+        {"user_id": user_id, "version": {"$exists": False}}, {"_id": 1}
+    ).sort("created_at", 1).to_list(length=None)
+    if not legacy:
+        return
+    
+    versions = await allocate_scan_versions(db, user_id, len(legacy))
+    now = datetime.utcnow().isoformat()
+    for scan, version in zip(legacy, versions):
+        # A concurrent backfill may have won; its leftover versions become
+        # gaps that scan_changes skips after SYNC_GAP_TIMEOUT
+        await db.scans.update_one(
+            {"_id": scan["_id"], "version": {"$exists": False}},
+            {"$set": {"version": version, "versioned_at": now}},
+        )
+
+
+async def scan_changes(db, user_id: str, cursor: int) -> Tuple[List[dict], int, bool]:
+    """Scans with a version above cursor; returns (changes, next cursor, has_more).
+
+    Versions are allocated before their scan is inserted, so a missing
+    version may belong to a scan still being written. The returned cursor
+    stops before such a gap, and changes past it are sent again on the next
+    sync (clients upsert by _id). A gap is only skipped once a later scan
+    was versioned more than SYNC_GAP_TIMEOUT seconds ago, i.e. the write
+    behind it failed.
+    """
+    with span("mongo_sync_changes"):
+        changes = await db.scans.find(
+            {"user_id": user_id, "version": {"$gt": cursor}}
+        ).sort("version", 1).limit(SYNC_MAX_CHANGES + 1).to_list(length=SYNC_MAX_CHANGES + 1)
+    has_more = len(changes) > SYNC_MAX_CHANGES
+    changes = changes[:SYNC_MAX_CHANGES]
+    
+    abandoned_before = (datetime.utcnow() - timedelta(seconds=SYNC_GAP_TIMEOUT)).isoformat()
+    next_cursor = cursor
+    for change in changes:
+        if change["version"] != next_cursor + 1 and change.get("versioned_at", "") > abandoned_before:
+            # Paging on would only return the same changes until the gap fills
+            return changes, next_cursor, False
+        next_cursor = change["version"]
+    return changes, next_cursor, has_more
+
+
+@router.post("/api/analyze-ingredients")
+async def analyze_ingredients(request: AnalyzeIngredientsRequest, state: State = Depends(get_state)):
+    """Analyze ingredients using AI"""
+    if not ObjectId.is_valid(request.user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
     
-    if not user.get("is_premium", False) and user.get("scans_today", 0) >= 5:
+    # Get user and check scan limits for free users
+    user = await load_user_for_scan(state.db, request.user_id)
+    if scans_remaining(user) == 0:
         raise HTTPException(
             status_code=403, 
             detail="Daily scan limit reached. Upgrade to premium for unlimited scans."
         )
     
-    # Analyze ingredients
+    # Analyze ingredients and save scan
     preferences = UserPreferences(**user.get("preferences", {}))
-    analysis = await ai_service.analyze_with_ai(request.ingredients_text, preferences)
+    analysis, _ = await analyze_and_insert_scan(state, request.user_id, request.ingredients_text, preferences)
+    await commit_scans(state.db, request.user_id, 1)
     
-    # Save scan
-    scan_data = {
-        "user_id": request.user_id,
-        "ingredients_text": request.ingredients_text,
-        "analysis": analysis.dict(),
-        "created_at": datetime.utcnow().isoformat()
-    }
-    await db.scans.insert_one(scan_data)
+    return product_analysis_response(analysis)
+
+
+@router.post("/api/sync")
+async def sync_scans(request: SyncRequest, state: State = Depends(get_state)):
+    """Upload scans queued offline and fetch history changed since a cursor.
+
+    Each queued scan carries a client-generated idempotency key, so a retried
+    batch never records a scan twice. Results report per-key status:
+    created, duplicate, limit_reached or failed (safe to retry).
+
+    The first sync (no cursor) returns the whole history, including scans
+    stored before sync existed. Changes may repeat across syncs; clients
+    upsert them by _id.
+    """
+    if not ObjectId.is_valid(request.user_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    if len(request.scans) > SYNC_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {SYNC_MAX_BATCH} scans per sync")
     
-    # Update scan count
-    await db.users.update_one(
-        {"_id": ObjectId(request.user_id)},
-        {"$inc": {"scans_today": 1}}
-    )
+    db = state.db
+    if not request.scans:
+        # Pull-only sync: nothing counts against the daily limit, but the user
+        # must still exist
+        with span("mongo_user_lookup"):
+            user = await db.users.find_one({"_id": ObjectId(request.user_id)}, USER_VERSION_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
     
-    return analysis
+    results = {}
+    if request.scans:
+        user = await load_user_for_scan(db, request.user_id)
+        
+        # Keys already recorded by an earlier (possibly timed-out) attempt
+        queued = {scan.idempotency_key: scan for scan in request.scans}
+        with span("mongo_idempotency_lookup"):
+            existing = await db.scans.find(
+                {"user_id": request.user_id, "idempotency_key": {"$in": list(queued)}},
+                {"idempotency_key": 1}
+            ).to_list(length=len(queued))
+        for scan in existing:
+            results[scan["idempotency_key"]] = {"status": "duplicate", "scan_id": scan["_id"]}
+        
+        pending = [scan for key, scan in queued.items() if key not in results]
+        remaining = scans_remaining(user)
+        if remaining is not None:
+            for scan in pending[remaining:]:
+                results[scan.idempotency_key] = {"status": "limit_reached", "scan_id": None}
+            pending = pending[:remaining]
+        
+        preferences = UserPreferences(**user.get("preferences", {}))
+        semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+        
+        async def process(offline_scan: OfflineScan):
+            async with semaphore:
+                try:
+                    _, scan = await analyze_and_insert_scan(
+                        state,
+                        request.user_id,
+                        offline_scan.ingredients_text,
+                        preferences,
+                        idempotency_key=offline_scan.idempotency_key,
+                        scanned_at=offline_scan.scanned_at,
+                    )
+                except DuplicateKeyError:
+                    # A concurrent retry of the same batch got there first
+                    scan = await db.scans.find_one(
+                        {"user_id": request.user_id, "idempotency_key": offline_scan.idempotency_key},
+                        {"_id": 1}
+                    )
+                    results[offline_scan.idempotency_key] = {"status": "duplicate", "scan_id": scan["_id"]}
+                    return False
+                results[offline_scan.idempotency_key] = {"status": "created", "scan_id": scan["_id"]}
+                return True
+        
+        # One failed scan must not keep the others from being counted
+        outcomes = await asyncio.gather(*(process(s) for s in pending), return_exceptions=True)
+        for offline_scan, outcome in zip(pending, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error("Sync scan %s failed", offline_scan.idempotency_key, exc_info=outcome)
+                results[offline_scan.idempotency_key] = {"status": "failed", "scan_id": None}
+        created = sum(outcome is True for outcome in outcomes)
+        if created:
+            await commit_scans(db, request.user_id, created)
+    
+    if request.cursor is None:
+        await backfill_scan_versions(db, request.user_id)
+    changes, cursor, has_more = await scan_changes(db, request.user_id, request.cursor or 0)
+    
+    return MongoJSONResponse({
+        "results": [
+            {"idempotency_key": scan.idempotency_key, **results[scan.idempotency_key]}
+            for scan in request.scans
+        ],
+        "changes": changes,
+        "cursor": cursor,
+        "has_more": has_more,
+    })
 
 
-@app.get("/api/users/{user_id}/scans")
-async def get_scan_history(user_id: str, limit: int = 20):
+@router.get("/api/users/{user_id}/scans")
+async def get_scan_history(user_id: str, request: Request, limit: int = 20, db=Depends(get_db)):
     """Get user's scan history"""
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
+    # Read the version before the scans: a concurrent scan can then only make
+    # the body newer than its ETag, never older
+    user_meta = await db.users.find_one({"_id": ObjectId(user_id)}, USER_VERSION_PROJECTION)
+    headers = user_validators(user_meta, f"scans-{user_id}-{limit}")
+    if has_conditional_headers(request):
+        if is_not_modified(request, headers):
+            return not_modified_response(headers)
+        CACHE_EVENTS.inc(("conditional_get", "miss"))
+    
     scans = await db.scans.find(
         {"user_id": user_id}
     ).sort("created_at", -1).limit(limit).to_list(length=limit)
     
-    for scan in scans:
-        scan["_id"] = str(scan["_id"])
+    return MongoJSONResponse(scans, headers=headers)
+
+
+@router.get("/api/scans/{scan_id}/alternatives")
+async def get_alternatives(scan_id: str, k: int = 5, state: State = Depends(get_state)):
+    """Suggest similar products with a better overall score than a scan"""
+    if not ObjectId.is_valid(scan_id):
+        raise HTTPException(status_code=400, detail="Invalid scan ID")
+    
+    scan = await state.db.scans.find_one(
+        {"_id": ObjectId(scan_id)},
+        {"ingredients_text": 1, "analysis.overall_score": 1, "analysis.recommendation": 1}
+    )
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    # Scans analyzed by another worker may not be indexed here yet. An indexed
+    # product is never refreshed from a read: this scan may be older than the
+    # analysis the index already holds
+    keys = ingredient_keys(scan["ingredients_text"])
+    product = state.similarity_index.get(product_id_for(keys))
+    if product is None:
+        product = state.similarity_index.add(
+            keys,
+            scan["analysis"]["overall_score"],
+            scan["analysis"]["recommendation"],
+            scan["ingredients_text"],
+        )
+    
+    with span("similarity_query"):
+        matches = state.similarity_index.similar(
+            product.ingredients, min_score=product.overall_score, k=max(1, min(k, 50)), exclude=product.product_id
+        )
     
-    return scans
+    return {
+        "scan_id": scan_id,
+        "overall_score": product.overall_score,
+        "alternatives": [
+            {
+                "product_id": match.product_id,
+                "ingredients_text": match.ingredients_text,
+                "overall_score": match.overall_score,
+                "recommendation": match.recommendation,
+                "similarity": round(similarity, 4),
+            }
+            for similarity, match in matches
+        ],
+    }
+
 
+def kb_headers(snapshot: KnowledgeBaseSnapshot, tag: str) -> Dict[str, str]:
+    # Weak: GZipMiddleware sends different bytes under the same tag depending
+    # on Accept-Encoding, which a strong validator must not do
+    return {"ETag": f'W/"{tag}"', "Cache-Control": KB_CACHE_CONTROL, "X-KB-Version": snapshot.version}
 
-@app.post("/api/payment/create-subscription")
-async def create_subscription(request: SubscriptionRequest):
+
+@router.get("/api/kb/snapshot")
+async def get_kb_snapshot(request: Request, state: State = Depends(get_state)):
+    """Binary knowledge-base snapshot for on-device scoring"""
+    kb_snapshot = state.kb_snapshot
+    headers = kb_headers(kb_snapshot, kb_snapshot.version)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    return Response(kb_snapshot.data, media_type="application/octet-stream", headers=headers)
+
+
+@router.get("/api/kb/delta/{base_version}")
+async def get_kb_delta(base_version: str, request: Request, state: State = Depends(get_state)):
+    """Changes from an earlier snapshot version to the current one.
+
+    Responds 404 when the base version is unknown; the client should then
+    download the full snapshot.
+    """
+    # Versions are 16 hex characters; anything else can't be known and must
+    # not reach the ETag header
+    if not KB_VERSION_PATTERN.fullmatch(base_version):
+        raise HTTPException(status_code=404, detail="Unknown knowledge-base version")
+    kb_snapshot = state.kb_snapshot
+    # Resolved before preconditions, so "If-None-Match: *" can't turn an
+    # unknown version's 404 into a 304
+    delta = state.kb_deltas.get(base_version)
+    if delta is None:
+        CACHE_EVENTS.inc(("kb_delta", "miss"))
+        stored = await state.db.kb_snapshots.find_one({"_id": base_version})
+        try:
+            base = decode_snapshot(stored["data"]) if stored else None
+        except ValueError:
+            # Published under an older format; no delta can be built from it
+            base = None
+        if base is None:
+            raise HTTPException(status_code=404, detail="Unknown knowledge-base version")
+        delta = build_delta(base, kb_snapshot)
+        state.kb_deltas[base_version] = delta
+    else:
+        CACHE_EVENTS.inc(("kb_delta", "hit"))
+    
+    headers = kb_headers(kb_snapshot, f"{base_version}-{kb_snapshot.version}")
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    return Response(delta, media_type="application/octet-stream", headers=headers)
+
+
+@router.post("/api/payment/create-subscription")
+async def create_subscription(request: SubscriptionRequest, db=Depends(get_db)):
     """Create PayPal subscription"""
     if not ObjectId.is_valid(request.user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
@@ -415,7 +1064,7 @@ async def create_subscription(request: SubscriptionRequest):
     # Update user to premium
     result = await db.users.update_one(
         {"_id": ObjectId(request.user_id)},
-        {"$set": {"is_premium": True}}
+        bump_user_version({"$set": {"is_premium": True}})
     )
     
     if result.modified_count == 0:
@@ -435,7 +1084,7 @@ async def create_subscription(request: SubscriptionRequest):
     return {"success": True, "message": "Subscription activated"}
 
 
-@app.get("/api/payment/config")
+@router.get("/api/payment/config")
 async def get_paypal_config():
     """Get PayPal client ID for frontend"""
     return {
@@ -444,6 +1093,180 @@ async def get_paypal_config():
     }
 
 
+# ============= Application Factory =============
+
+async def ensure_indexes(database):
+    """Create the indexes the read paths rely on (idempotent)"""
+    await database.scans.create_index([("user_id", 1), ("created_at", -1)])
+    await database.scans.create_index(
+        [("user_id", 1), ("version", 1)],
+        unique=True,
+        partialFilterExpression={"version": {"$exists": True}},
+    )
+    await database.scans.create_index(
+        [("user_id", 1), ("idempotency_key", 1)],
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$exists": True}},
+    )
+
+
+SIMILARITY_WARM_PROJECTION = {
+    "_id": 0, "ingredients_text": 1, "analysis.overall_score": 1, "analysis.recommendation": 1,
+}
+
+
+async def warm_similarity_index(database, index: ProductSimilarityIndex):
+    """Load recently analyzed products into the alternatives index.
+
+    Runs in the background once startup has finished. Scans stream newest first
+    in batches, so memory holds one batch at a time. The first analysis seen
+    for a product is its latest one; older ones, and products a live request
+    has indexed meanwhile, are skipped.
+    """
+    cursor = database.scans.find({}, SIMILARITY_WARM_PROJECTION).sort("created_at", -1).limit(
+        SIMILARITY_WARM_LIMIT
+    ).batch_size(SIMILARITY_WARM_BATCH_SIZE)
+    loaded = 0
+    try:
+        with span("similarity_warm"):
+            async for scan in cursor:
+                keys = ingredient_keys(scan["ingredients_text"])
+                if index.get(product_id_for(keys)) is None:
+                    index.add(
+                        keys,
+                        scan["analysis"]["overall_score"],
+                        scan["analysis"]["recommendation"],
+                        scan["ingredients_text"],
+                    )
+                loaded += 1
+                if loaded % SIMILARITY_WARM_BATCH_SIZE == 0:
+                    # Parsing is CPU-bound; let requests run between batches
+                    await asyncio.sleep(0)
+    except Exception:
+        logger.exception("Similarity index warm-up stopped after %d scans", loaded)
+
+
+async def publish_kb_snapshot(database, snapshot: KnowledgeBaseSnapshot):
+    """Keep every snapshot version ever served so later deltas can be built from it"""
+    await database.kb_snapshots.update_one(
+        {"_id": snapshot.version},
+        {"$setOnInsert": {"data": snapshot.data, "created_at": datetime.utcnow().isoformat()}},
+        upsert=True,
+    )
+
+
+def warm_llm_client():
+    """Import the LLM integration up front so the first scan doesn't pay for it"""
+    try:
+        import emergentintegrations.llm.chat  # noqa: F401
+    except ImportError as e:
+        logger.warning("LLM client unavailable, using rule-based analysis: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    state = app.state
+    mongo_client = None
+    
+    with span("startup"):
+        if state.database is not None:
+            state.db = state.database
+        else:
+            mongo_client = AsyncIOMotorClient(
+                MONGO_URL,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            )
+            await mongo_client.admin.command("ping")
+            state.db = mongo_client.grocery_detective
+        
+        state.ai_service = AIAnalysisService()
+        state.kb_snapshot = build_snapshot(entries_from_service(state.ai_service), aliases_from_parser())
+        # base version -> encoded delta to the current snapshot
+        state.kb_deltas = {}
+        await publish_kb_snapshot(state.db, state.kb_snapshot)
+        warm_llm_client()
+        await ensure_indexes(state.db)
+        state.similarity_index = ProductSimilarityIndex()
+        # Startup just reached the database, so the first probe needn't ping
+        state.db_reachable = True
+        state.db_pinged_at = time.monotonic()
+    # Alternatives are best-effort, so serving doesn't wait for the index
+    similarity_warmup = asyncio.create_task(warm_similarity_index(state.db, state.similarity_index))
+    metrics_flush = asyncio.create_task(flush_periodically()) if metrics_registry.MULTIPROC_DIR else None
+    
+    try:
+        yield
+    finally:
+        # Uvicorn has already drained in-flight requests at this point. The
+        # tasks are awaited so the final metrics flush and any warm-up query
+        # finish before the client closes.
+        background = [task for task in (similarity_warmup, metrics_flush) if task is not None]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if mongo_client is not None:
+            mongo_client.close()
+
+
+def create_app(database=None) -> FastAPI:
+    """Build the API application
+
+    database: optional pre-built database handle (e.g. for load tests); when
+    omitted the lifespan opens a pooled Mongo client from MONGO_URL.
+    """
+    application = FastAPI(
+        title="Grocery Detective API",
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan,
+    )
+    application.state.database = database
+    
+    # CORS
+    application.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    application.add_middleware(MetricsMiddleware)
+    application.include_router(router)
+    return application
+
+
+app = create_app()
+
+
+def worker_count() -> int:
+    """WEB_CONCURRENCY if set, otherwise one worker per usable core"""
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.getenv("WEB_CONCURRENCY"))
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 if __name__ == "__main__":
+    import tempfile
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    
+    workers = worker_count()
+    if workers > 1 and not metrics_registry.MULTIPROC_DIR:
+        # Workers are spawned fresh and read this at import, so /api/metrics
+        # reports the sum over all of them rather than whichever one answered
+        metrics_registry.MULTIPROC_DIR = os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(
+            prefix="grocery-detective-metrics-"
+        )
+    metrics_registry.reset_multiprocess_dir()
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8001")),
+        workers=workers,
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30")),
+        proxy_headers=True,
+    )
@@ -0,0 +1,126 @@
+"""Inverted index over analyzed products for healthier-alternative lookups.
+
+Products are sparse binary vectors over canonical ingredient keys, compared by
+IDF-weighted cosine similarity. Candidates come from the postings of the
+query's rarer ingredients only. Near-universal ingredients such as water or
+salt would otherwise make every query touch most of the catalog, and they
+carry almost no IDF weight anyway. Both the posting entries examined and the
+candidates kept are capped, so query cost stays bounded as the catalog grows
+into the millions, however few products beat the queried one.
+"""
+from dataclasses import dataclass
+from hashlib import sha1
+from math import log, sqrt
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import heapq
+
+
+@dataclass
+class IndexedProduct:
+    product_id: str
+    ingredients: FrozenSet[str]
+    overall_score: int
+    recommendation: str
+    ingredients_text: str
+    norm: float = 0.0
+
+
+def product_id_for(ingredients: Iterable[str]) -> str:
+    """Stable ID for an ingredient set, independent of label order"""
+    return sha1("\x1f".join(sorted(ingredients)).encode()).hexdigest()[:16]
+
+
+class ProductSimilarityIndex:
+    def __init__(self, max_posting_length: int = 20000, max_candidates: int = 2000,
+                 max_scanned: int = 20000):
+        self.max_posting_length = max_posting_length
+        self.max_candidates = max_candidates
+        self.max_scanned = max_scanned
+        self._products: Dict[str, IndexedProduct] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        # Product norms are cached and recomputed whenever the catalog has
+        # doubled since the last pass, keeping inserts amortized O(1)
+        self._reweighted_at = 0
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def get(self, product_id: str) -> Optional[IndexedProduct]:
+        return self._products.get(product_id)
+
+    def add(self, ingredients: FrozenSet[str], overall_score: int, recommendation: str,
+            ingredients_text: str) -> IndexedProduct:
+        """Insert or refresh a product; the latest analysis wins"""
+        product_id = product_id_for(ingredients)
+        product = self._products.get(product_id)
+        if product is not None:
+            product.overall_score = overall_score
+            product.recommendation = recommendation
+            return product
+
+        product = IndexedProduct(product_id, ingredients, overall_score, recommendation, ingredients_text)
+        self._products[product_id] = product
+        for ingredient in ingredients:
+            self._postings.setdefault(ingredient, set()).add(product_id)
+        product.norm = self._norm(ingredients)
+
+        if len(self._products) >= 2 * self._reweighted_at:
+            self.reweight()
+        return product
+
+    def reweight(self):
+        """Recompute cached product norms against current IDF weights"""
+        for product in self._products.values():
+            product.norm = self._norm(product.ingredients)
+        self._reweighted_at = len(self._products)
+
+    def _idf(self, ingredient: str) -> float:
+        df = len(self._postings.get(ingredient, ()))
+        return log((len(self._products) + 1) / (df + 1)) + 1.0
+
+    def _norm(self, ingredients: Iterable[str]) -> float:
+        return sqrt(sum(self._idf(i) ** 2 for i in ingredients))
+
+    def _candidates(self, ingredients: FrozenSet[str], min_score: int, exclude: Optional[str]) -> Set[str]:
+        postings = sorted(
+            (self._postings[i] for i in ingredients if i in self._postings),
+            key=len,
+        )
+        products = self._products
+        candidates: Set[str] = set()
+        budget = self.max_scanned
+        for posting in postings:
+            # Past this point only near-universal ingredients remain
+            if len(posting) > self.max_posting_length:
+                break
+            for product_id in posting:
+                # Entries are budgeted whether or not they qualify, so a query
+                # that few products beat still stops early
+                budget -= 1
+                if budget < 0:
+                    return candidates
+                # Filtered before the cap, so products that can never qualify
+                # don't use up the candidate budget
+                if product_id == exclude or products[product_id].overall_score <= min_score:
+                    continue
+                candidates.add(product_id)
+                if len(candidates) >= self.max_candidates:
+                    return candidates
+        return candidates
+
+    def similar(self, ingredients: FrozenSet[str], min_score: int, k: int = 5,
+                exclude: Optional[str] = None) -> List[Tuple[float, IndexedProduct]]:
+        """Top-k products most similar to `ingredients` scoring above min_score"""
+        if not ingredients:
+            return []
+
+        weights = {i: self._idf(i) ** 2 for i in ingredients}
+        query_norm = sqrt(sum(weights.values()))
+
+        scored = []
+        for product_id in self._candidates(ingredients, min_score, exclude):
+            product = self._products[product_id]
+            dot = sum(weights[i] for i in ingredients & product.ingredients)
+            scored.append((dot / (query_norm * product.norm), product))
+
+        return heapq.nlargest(k, scored, key=lambda pair: (pair[0], pair[1].overall_score))
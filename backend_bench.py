@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Grocery Detective Microbenchmarks
+Isolates the CPU hot paths of the backend: the rule-based fallback engine,
+ProductAnalysis construction/serialization and the LLM response parse.
+
+The fallback engine memoizes token normalization and knowledge-base lookups,
+so it is measured twice: fallback_warm repeats one label and is answered from
+those caches, fallback_cold clears them before every call and pays for every
+lookup, as for a label the process has not seen yet.
+
+    python backend_bench.py                          # run and print results
+    python backend_bench.py --save-baseline base.json
+    python backend_bench.py --compare base.json      # exit 1 on regression or on a
+                                                     # baseline entry that was not run
+
+All inputs are generated synthetically from a fixed seed, so runs on the same
+machine are comparable between commits.
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from ingredient_parser import canonicalize  # noqa: E402
+from server import AIAnalysisService, ProductAnalysis, UserPreferences  # noqa: E402
+
+INGREDIENT_COUNTS = (5, 50, 500)
+KNOWLEDGE_BASE_SIZES = (15, 1000, 50000)
+QUICK_KNOWLEDGE_BASE_SIZES = (15, 1000)
+
+FILLER_INGREDIENTS = [
+    "water", "sugar", "salt", "enriched flour", "vegetable oil", "natural flavors",
+    "citric acid", "corn starch", "yeast", "garlic powder", "milk", "eggs", "soy lecithin",
+    "wheat flour", "cocoa butter", "vanilla extract", "baking soda", "sesame seeds",
+]
+
+PREFERENCES = UserPreferences(
+    dietary_restrictions=["vegetarian"],
+    allergens=["milk", "soy", "peanuts"],
+    health_goals=["low sugar"],
+)
+
+
+# ============= Synthetic data =============
+
+def synthetic_name(rng):
+    words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(rng.randint(1, 3))]
+    return " ".join(words)
+
+
+def build_service(kb_size, seed=0):
+    """An AIAnalysisService whose harmful-ingredient table holds kb_size entries"""
+    rng = random.Random(seed)
+    service = AIAnalysisService()
+    harmful = dict(service.harmful_ingredients)
+    while len(harmful) < kb_size:
+        harmful[synthetic_name(rng)] = {
+            "score": rng.randint(40, 95),
+            "impact": "Synthetic benchmark entry",
+        }
+    service.harmful_ingredients = harmful
+    return service
+
+
+def build_ingredients_text(count, service, seed=0):
+    """Comma-separated label text where roughly 1 in 8 ingredients is a known harmful one"""
+    rng = random.Random(seed)
+    known = list(service.harmful_ingredients)[:15]
+    ingredients = [
+        rng.choice(known) if rng.random() < 0.125 else rng.choice(FILLER_INGREDIENTS)
+        for _ in range(count)
+    ]
+    return ", ".join(ingredients)
+
+
+def clear_caches(service):
+    """Drop the per-token caches the fallback engine fills as it runs"""
+    canonicalize.cache_clear()
+    service.harmful_match.cache_clear()
+    service.ingredient_trait_masks.cache_clear()
+
+
+def analyze_cold(service, text):
+    clear_caches(service)
+    return service.analyze_ingredients_fallback(text, PREFERENCES)
+
+
+def build_analysis_data(count, seed=0):
+    service = build_service(15, seed)
+    return service.analyze_ingredients_fallback(build_ingredients_text(count, service, seed), PREFERENCES).dict()
+
+
+def build_llm_response(count, seed=0):
+    return f"```json\n{json.dumps(build_analysis_data(count, seed), indent=2)}\n```"
+
+
+# ============= Runner =============
+
+def measure(func, min_time=0.2, repeats=5):
+    """Best-of-N ops/sec and peak traced allocation per op"""
+    func()  # warm caches and lazy imports
+
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeats or number >= 1 << 20:
+            break
+        number *= 2
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            best = min(best, (time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "ops_per_sec": round(1 / best, 2),
+        "us_per_op": round(best * 1e6, 3),
+        "peak_alloc_kib": round(peak / 1024, 2),
+    }
+
+
+def benchmarks(quick=False):
+    """Yield (name, callable) pairs"""
+    for kb_size in QUICK_KNOWLEDGE_BASE_SIZES if quick else KNOWLEDGE_BASE_SIZES:
+        service = build_service(kb_size)
+        for count in INGREDIENT_COUNTS:
+            text = build_ingredients_text(count, service)
+            yield (
+                f"fallback_warm[ingredients={count},kb={kb_size}]",
+                lambda service=service, text=text: service.analyze_ingredients_fallback(text, PREFERENCES),
+            )
+            yield (
+                f"fallback_cold[ingredients={count},kb={kb_size}]",
+                lambda service=service, text=text: analyze_cold(service, text),
+            )
+
+    for count in INGREDIENT_COUNTS:
+        data = build_analysis_data(count)
+        analysis = ProductAnalysis(**data)
+        yield f"product_analysis_construct[ingredients={count}]", lambda data=data: ProductAnalysis(**data)
+        yield f"product_analysis_dict[ingredients={count}]", lambda analysis=analysis: analysis.dict()
+
+    service = AIAnalysisService()
+    for count in INGREDIENT_COUNTS:
+        response = build_llm_response(count)
+        yield f"llm_parse[ingredients={count}]", lambda response=response: service._parse_llm_response(response)
+
+
+def compare(results, baseline, threshold):
+    """Return (regressed, unmeasured, new) benchmark names versus baseline
+
+    regressed: ops/sec dropped by more than threshold. unmeasured: in the
+    baseline but not in results, e.g. renamed, so nothing checked them.
+    new: in results with no baseline to compare against.
+    """
+    regressions = []
+    unmeasured = [name for name in baseline if name not in results]
+    new = [name for name in results if name not in baseline]
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = stats["ops_per_sec"] / base["ops_per_sec"] - 1
+        stats["change_vs_baseline"] = round(change, 4)
+        if change < -threshold:
+            regressions.append(name)
+    return regressions, unmeasured, new
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--quick", action="store_true", help="skip the largest knowledge-base size")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds of timed work per benchmark")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as a baseline file")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a baseline file")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="allowed ops/sec drop before a benchmark is flagged (default 15%%)")
+    parser.add_argument("--output", metavar="PATH", help="write results as JSON")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {}
+
+    print(f"{'benchmark':<52}{'ops/sec':>14}{'us/op':>14}{'peak KiB':>12}")
+    for name, func in benchmarks(quick=args.quick):
+        if args.filter and args.filter not in name:
+            continue
+        stats = measure(func, min_time=args.min_time)
+        results[name] = stats
+        print(f"{name:<52}{stats['ops_per_sec']:>14.2f}{stats['us_per_op']:>14.3f}{stats['peak_alloc_kib']:>12.2f}")
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if args.filter:
+            baseline = {name: stats for name, stats in baseline.items() if args.filter in name}
+        regressions, unmeasured, new = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print(f"❌ Regression: {name} ({results[name]['change_vs_baseline']:+.1%} ops/sec)")
+        for name in unmeasured:
+            print(f"❌ Not measured: {name} is in {args.compare} but was not run (renamed or skipped?)")
+        for name in new:
+            print(f"⚠️  No baseline: {name}")
+        if regressions or unmeasured:
+            exit_code = 1
+        else:
+            print(f"✅ No regressions beyond {args.threshold:.0%} versus {args.compare}")
+
+    payload = {"python": sys.version.split()[0], "results": results}
+    for path in (args.save_baseline, args.output):
+        if path:
+            with open(path, "w") as f:
+                json.dump(payload, f, indent=2)
+            print(f"Results written to {path}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
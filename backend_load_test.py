@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Grocery Detective API Load Testing
+Drives mixed traffic against the FastAPI app at a target RPS and reports
+throughput and latency percentiles per endpoint.
+
+By default the app runs in-process against an in-memory Mongo stand-in and a
+mock LLM, so no deployment, mongod or API key is needed:
+
+    python backend_load_test.py --rps 200 --duration 30 --output load.json
+
+Use --mongo-url to run against a local mongod instead, or --base-url to drive
+an already running server (the mock LLM then does not apply).
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+SAMPLE_INGREDIENTS = [
+    "water, sugar, high fructose corn syrup, phosphoric acid, caramel color, natural flavors, caffeine",
+    "enriched flour, sugar, vegetable oil, salt, bht, red dye 40, yellow 5",
+    "organic oats, honey, almonds, sea salt",
+    "milk, cream, sugar, eggs, vanilla extract, carrageenan",
+    "pork, water, salt, sodium nitrite, sodium erythorbate, msg",
+    "tomatoes, water, olive oil, garlic, basil, salt",
+    "wheat flour, soy lecithin, sesame seeds, yeast, sodium benzoate, tbhq",
+    "sugar, gelatin, aspartame, blue 1, citric acid",
+]
+
+DIETARY_RESTRICTIONS = ["vegan", "vegetarian", "gluten-free", "halal", "kosher", "keto"]
+ALLERGENS = ["milk", "eggs", "peanuts", "soy", "wheat", "sesame"]
+HEALTH_GOALS = ["weight loss", "low sugar", "low sodium", "heart health"]
+
+# endpoint name -> relative weight in the traffic mix
+DEFAULT_MIX = {
+    "create_user": 5,
+    "analyze": 40,
+    "history": 40,
+    "preferences": 15,
+}
+
+# Endpoints that can be added to the mix with --mix but are off by default,
+# so results stay comparable with earlier runs
+OPTIONAL_ENDPOINTS = ("sync",)
+
+
+# ============= In-memory Mongo stand-in =============
+
+def _get_path(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _set_path(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        value = _get_path(doc, key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$gt" and (value is None or not value > operand):
+                    return False
+                if op == "$gte" and (value is None or not value >= operand):
+                    return False
+                if op == "$exists" and (value is not None) != operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    projected = {"_id": doc["_id"]} if projection.get("_id", 1) else {}
+    for key, include in projection.items():
+        if include and key != "_id":
+            value = _get_path(doc, key)
+            if value is not None:
+                _set_path(projected, key, copy.deepcopy(value))
+    return projected
+
+
+class _UpdateResult:
+    def __init__(self, matched_count, modified_count):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+
+class _InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class InMemoryCursor:
+    def __init__(self, docs, projection=None):
+        self._docs = docs
+        self._projection = projection
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda d: (_get_path(d, key) is not None, _get_path(d, key)), reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    async def __aiter__(self):
+        for doc in await self.to_list():
+            yield doc
+
+    async def to_list(self, length=None):
+        docs = self._docs[:self._limit] if self._limit else self._docs
+        if length is not None:
+            docs = docs[:length]
+        return [_project(d, self._projection) for d in docs]
+
+
+class InMemoryCollection:
+    """The subset of the motor collection API used by server.py"""
+
+    def __init__(self):
+        self._docs = {}
+
+    async def insert_one(self, document):
+        document.setdefault("_id", ObjectId())
+        self._docs[document["_id"]] = copy.deepcopy(document)
+        return _InsertResult(document["_id"])
+
+    async def find_one(self, query, projection=None):
+        for doc in self._docs.values():
+            if _matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query, projection=None):
+        return InMemoryCursor([d for d in self._docs.values() if _matches(d, query)], projection)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False):
+        for doc in self._docs.values():
+            if _matches(doc, query):
+                before = _project(doc, projection)
+                self._apply(doc, update)
+                return _project(doc, projection) if return_document else before
+        return None
+
+    async def update_many(self, query, update):
+        matched = [doc for doc in self._docs.values() if _matches(doc, query)]
+        for doc in matched:
+            self._apply(doc, update)
+        return _UpdateResult(len(matched), len(matched))
+
+    async def create_index(self, keys, **kwargs):
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self._docs.values():
+            if _matches(doc, query):
+                self._apply(doc, update)
+                return _UpdateResult(1, 1)
+        if upsert:
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            self._apply(doc, {"$set": update.get("$setOnInsert", {})})
+            self._apply(doc, update)
+            await self.insert_one(doc)
+        return _UpdateResult(0, 0)
+
+    @staticmethod
+    def _apply(doc, update):
+        for key, value in update.get("$set", {}).items():
+            _set_path(doc, key, copy.deepcopy(value))
+        for key, value in update.get("$inc", {}).items():
+            _set_path(doc, key, (_get_path(doc, key) or 0) + value)
+
+
+class InMemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, InMemoryCollection())
+
+    async def command(self, name):
+        return {"ok": 1.0}
+
+
+# ============= Mock LLM =============
+
+def install_mock_llm(service, latency_ms, failure_rate):
+    """Replace the LLM round trip with a local responder
+
+    Responses are produced by the rule engine and wrapped in a markdown fence,
+    so the real parse and validation path still runs.
+    """
+    import server
+
+    async def mock_completion(system_message, ingredients_text):
+        await asyncio.sleep(max(0.0, random.gauss(latency_ms, latency_ms * 0.2)) / 1000)
+        if random.random() < failure_rate:
+            raise RuntimeError("mock LLM failure")
+        analysis = service.analyze_ingredients_fallback(ingredients_text, server.UserPreferences())
+        return f"```json\n{analysis.model_dump_json()}\n```"
+
+    service._request_completion = mock_completion
+
+
+# ============= Load generator =============
+
+class LoadTest:
+    def __init__(self, client, rps, duration, users, mix):
+        self.client = client
+        self.rps = rps
+        self.duration = duration
+        self.initial_users = users
+        self.mix_names = list(mix)
+        self.mix_weights = [mix[name] for name in self.mix_names]
+        self.user_ids = []
+        self.etags = {}
+        self.sync_cursors = {}
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _random_user_payload(self):
+        n = random.randrange(1_000_000_000)
+        return {
+            "email": f"load{n}@grocerydetective.com",
+            "name": f"Load User {n}",
+            "preferences": self._random_preferences(),
+            # Premium users skip the daily free-scan limit
+            "is_premium": True,
+        }
+
+    @staticmethod
+    def _random_preferences():
+        return {
+            "dietary_restrictions": random.sample(DIETARY_RESTRICTIONS, random.randint(0, 2)),
+            "allergens": random.sample(ALLERGENS, random.randint(0, 2)),
+            "health_goals": random.sample(HEALTH_GOALS, random.randint(0, 2)),
+        }
+
+    async def _timed(self, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.samples[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+    async def create_user(self):
+        response = await self._timed("create_user", "POST", "/api/users", json=self._random_user_payload())
+        if response is not None and response.status_code == 200:
+            self.user_ids.append(response.json()["_id"])
+
+    async def analyze(self):
+        await self._timed("analyze", "POST", "/api/analyze-ingredients", json={
+            "user_id": random.choice(self.user_ids),
+            "ingredients_text": random.choice(SAMPLE_INGREDIENTS),
+        })
+
+    async def history(self):
+        # Revalidate like the mobile app does when a screen regains focus
+        user_id = random.choice(self.user_ids)
+        headers = {"If-None-Match": self.etags[user_id]} if user_id in self.etags else {}
+        response = await self._timed("history", "GET", f"/api/users/{user_id}/scans",
+                                     params={"limit": 50}, headers=headers)
+        if response is not None and "etag" in response.headers:
+            self.etags[user_id] = response.headers["etag"]
+
+    async def preferences(self):
+        await self._timed("preferences", "POST", "/api/users/preferences", json={
+            "user_id": random.choice(self.user_ids),
+            **self._random_preferences(),
+        })
+
+    async def sync(self):
+        # Upload a small offline queue and pull the history delta
+        user_id = random.choice(self.user_ids)
+        response = await self._timed("sync", "POST", "/api/sync", json={
+            "user_id": user_id,
+            "cursor": self.sync_cursors.get(user_id),
+            "scans": [
+                {"idempotency_key": uuid.uuid4().hex, "ingredients_text": random.choice(SAMPLE_INGREDIENTS)}
+                for _ in range(random.randint(1, 5))
+            ],
+        })
+        if response is not None and response.status_code == 200:
+            self.sync_cursors[user_id] = response.json()["cursor"]
+
+    async def setup(self):
+        await asyncio.gather(*(self.create_user() for _ in range(self.initial_users)))
+        if not self.user_ids:
+            raise RuntimeError("Could not create any users; is the API reachable?")
+        self.samples.clear()
+        self.errors.clear()
+
+    async def run(self):
+        await self.setup()
+        tasks = []
+        total = int(self.rps * self.duration)
+        start = time.perf_counter()
+        # Open-loop schedule: requests are issued on time regardless of how
+        # long earlier ones take, so server slowdowns show up as latency.
+        for i in range(total):
+            delay = start + i / self.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint = random.choices(self.mix_names, self.mix_weights)[0]
+            tasks.append(asyncio.create_task(getattr(self, endpoint)()))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile: the smallest value with at least pct% of samples at or below it"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(load_test, elapsed):
+    endpoints = {}
+    for endpoint in load_test.mix_names:
+        latencies = sorted(load_test.samples.get(endpoint, []))
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "errors": load_test.errors.get(endpoint, 0),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+        }
+    completed = sum(e["requests"] for e in endpoints.values())
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "completed_requests": completed,
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0,
+        "endpoints": endpoints,
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(summary):
+    print(f"\n{'endpoint':<14}{'reqs':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in summary["endpoints"].items():
+        print(f"{name:<14}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}{_fmt(stats['p99_ms']):>10}")
+    print(f"\nTotal: {summary['completed_requests']} requests in {summary['elapsed_s']}s "
+          f"({summary['throughput_rps']} req/s)")
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=100, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="test duration in seconds")
+    parser.add_argument("--users", type=int, default=50, help="users created before the run")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="traffic mix, e.g. analyze=40,history=40,preferences=15,create_user=5,sync=5")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="mean mock LLM latency")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.05, help="mock LLM failure probability")
+    parser.add_argument("--mongo-url", help="use a local mongod instead of the in-memory stand-in")
+    parser.add_argument("--base-url", help="drive an already running server instead of the in-process app")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible traffic")
+    parser.add_argument("--output", default="load_test_results.json", help="machine-readable results file")
+    return parser.parse_args()
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX and name not in OPTIONAL_ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+@asynccontextmanager
+async def in_process_client(args):
+    """Start the app (including its lifespan) and yield a client bound to it"""
+    import server
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        database = AsyncIOMotorClient(args.mongo_url).grocery_detective_load_test
+    else:
+        database = InMemoryDatabase()
+
+    app = server.create_app(database=database)
+    async with app.router.lifespan_context(app):
+        install_mock_llm(app.state.ai_service, args.llm_latency_ms, args.llm_failure_rate)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            yield client
+
+
+@asynccontextmanager
+async def remote_client(args):
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+        yield client
+
+
+async def main():
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    mode = "remote" if args.base_url else ("mongod" if args.mongo_url else "in-memory")
+    print(f"Load testing Grocery Detective API ({mode}) at {args.rps} req/s for {args.duration}s")
+
+    client_context = remote_client(args) if args.base_url else in_process_client(args)
+    async with client_context as client:
+        load_test = LoadTest(client, args.rps, args.duration, args.users, parse_mix(args.mix))
+        elapsed = await load_test.run()
+
+    summary = summarize(load_test, elapsed)
+    print_report(summary)
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "config": {
+            "mode": mode,
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "users": args.users,
+            "mix": parse_mix(args.mix),
+            "llm_latency_ms": args.llm_latency_ms if not args.base_url else None,
+            "llm_failure_rate": args.llm_failure_rate if not args.base_url else None,
+            "seed": args.seed,
+        },
+        **summary,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from backend_load_test import InMemoryDatabase  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    return InMemoryDatabase()
+
+
+@pytest.fixture
+def app(database):
+    import server
+    return server.create_app(database=database)
+
+
+async def _llm_unavailable(system_message, ingredients_text):
+    raise RuntimeError("LLM disabled in tests")
+
+
+@pytest.fixture
+def client(app):
+    # Entering the client runs the app lifespan
+    with TestClient(app) as test_client:
+        # Every analysis takes the deterministic rule-based fallback
+        app.state.ai_service._request_completion = _llm_unavailable
+        yield test_client
+
+
+@pytest.fixture
+def user_id(client):
+    response = client.post("/api/users", json={"email": "test@grocerydetective.com", "name": "Test User"})
+    assert response.status_code == 200
+    return response.json()["_id"]
@@ -0,0 +1,55 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import server
+from backend_load_test import InMemoryDatabase
+
+
+def test_ready_after_startup(client):
+    assert client.get("/api/ready").json() == {"ready": True}
+
+
+def test_apps_keep_separate_resources():
+    first_db, second_db = InMemoryDatabase(), InMemoryDatabase()
+    first_app = server.create_app(database=first_db)
+    second_app = server.create_app(database=second_db)
+
+    with TestClient(first_app) as first, TestClient(second_app) as second:
+        assert first_app.state.db is first_db
+        assert second_app.state.db is second_db
+        assert first_app.state.similarity_index is not second_app.state.similarity_index
+
+        user_id = first.post("/api/users", json={"email": "a@example.com", "name": "A"}).json()["_id"]
+        assert first.get(f"/api/users/{user_id}").status_code == 200
+        assert second.get(f"/api/users/{user_id}").status_code == 404
+
+
+def test_not_ready_while_database_unreachable(client, app, database, monkeypatch):
+    async def failing_ping(name):
+        raise ConnectionError("no primary")
+
+    monkeypatch.setattr(database, "command", failing_ping)
+    app.state.db_pinged_at = float("-inf")
+    assert client.get("/api/ready").status_code == 503
+
+    monkeypatch.undo()
+    app.state.db_pinged_at = float("-inf")
+    assert client.get("/api/ready").status_code == 200
+
+
+def test_shutdown_waits_for_final_metrics_flush(monkeypatch, tmp_path):
+    flushed = []
+
+    async def flush_periodically():
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await asyncio.sleep(0.05)
+            flushed.append(True)
+
+    monkeypatch.setattr(server.metrics_registry, "MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "flush_periodically", flush_periodically)
+    with TestClient(server.create_app(database=InMemoryDatabase())):
+        pass
+    assert flushed == [True]
@@ -0,0 +1,48 @@
+from email.utils import formatdate
+
+PREFERENCES = {"dietary_restrictions": ["vegan"], "allergens": ["milk"], "health_goals": []}
+
+
+def test_user_revalidation_returns_304_then_200_after_write(client, user_id):
+    first = client.get(f"/api/users/{user_id}")
+    etag = first.headers["etag"]
+
+    cached = client.get(f"/api/users/{user_id}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+
+    client.post("/api/users/preferences", json={"user_id": user_id, **PREFERENCES})
+
+    fresh = client.get(f"/api/users/{user_id}", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["etag"] != etag
+    assert fresh.json()["preferences"]["allergens"] == ["milk"]
+
+
+def test_if_modified_since_never_returns_stale_304(client, user_id):
+    client.get(f"/api/users/{user_id}")
+    client.post("/api/users/preferences", json={"user_id": user_id, **PREFERENCES})
+
+    response = client.get(f"/api/users/{user_id}", headers={"If-Modified-Since": formatdate(usegmt=True)})
+    assert response.status_code == 200
+    assert "last-modified" not in response.headers
+
+
+def test_history_revalidation_after_scan(client, user_id):
+    first = client.get(f"/api/users/{user_id}/scans")
+    assert first.json() == []
+    etag = first.headers["etag"]
+    assert client.get(f"/api/users/{user_id}/scans", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/analyze-ingredients", json={"user_id": user_id, "ingredients_text": "water, salt"})
+
+    fresh = client.get(f"/api/users/{user_id}/scans", headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert len(fresh.json()) == 1
+
+
+def test_weak_and_list_etags_match(client, user_id):
+    etag = client.get(f"/api/users/{user_id}").headers["etag"]
+    strong = etag.removeprefix("W/")
+    response = client.get(f"/api/users/{user_id}", headers={"If-None-Match": f'"other", {strong}'})
+    assert response.status_code == 304
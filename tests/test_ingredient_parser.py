@@ -0,0 +1,90 @@
+import pytest
+
+from ingredient_parser import canonicalize, flatten, leaves, parse_ingredients
+from server import AIAnalysisService, UserPreferences
+
+
+@pytest.fixture(scope="module")
+def service():
+    return AIAnalysisService()
+
+
+def shape(nodes):
+    return [(node.key, shape(node.children)) if node.children else node.key for node in nodes]
+
+
+def test_nested_groups_become_children():
+    nodes = parse_ingredients("Cheese (Milk, Cultures [Lactobacillus, Streptococcus]), Salt")
+    assert shape(nodes) == [("cheese", ["milk", ("cultures", ["lactobacillus", "streptococcus"])]), "salt"]
+
+
+def test_unbalanced_brackets_do_not_lose_ingredients():
+    assert shape(parse_ingredients("flour (wheat, malt, salt")) == [("flour", ["wheat", "malt", "salt"])]
+    assert shape(parse_ingredients("sugar), salt")) == ["sugar", "salt"]
+
+
+def test_and_or_and_semicolons_separate_ingredients():
+    assert shape(parse_ingredients("Canola and/or Sunflower Oil; Salt")) == ["canola", "sunflower oil", "salt"]
+
+
+def test_qualifiers_and_prefix_are_stripped():
+    nodes = parse_ingredients("Ingredients: Water, Contains 2% or less of: Salt, Spices")
+    assert shape(nodes) == ["water", "salt", "spices"]
+
+
+def test_percentages_are_extracted():
+    (sugar,) = parse_ingredients("Sugar 12.5%")
+    assert (sugar.name, sugar.percent) == ("sugar", 12.5)
+
+
+def test_e_numbers_resolve_to_their_names():
+    assert canonicalize("E330").key == "citric acid"
+    assert canonicalize("e-102").key == "yellow 5"
+    assert shape(parse_ingredients("color (e102, E 129)")) == [("color", ["yellow 5", "red dye 40"])]
+
+
+def test_descriptors_and_repeats_are_pruned():
+    assert shape(parse_ingredients("BHT (Preservative), Natural Flavor (to preserve freshness)")) == [
+        "bht", "natural flavor",
+    ]
+    # A child naming its own parent adds nothing
+    assert shape(parse_ingredients("red 40 lake (red 40)")) == ["red dye 40"]
+
+
+def test_leaves_carry_their_path():
+    nodes = parse_ingredients("enriched flour (wheat flour, niacin), salt")
+    assert [(leaf.key, [n.key for n in path]) for leaf, path in leaves(nodes)] == [
+        ("wheat flour", ["enriched flour", "wheat flour"]),
+        ("niacin", ["enriched flour", "niacin"]),
+        ("salt", ["salt"]),
+    ]
+    assert [n.key for n in flatten(nodes)] == ["enriched flour", "wheat flour", "niacin", "salt"]
+
+
+def test_groups_do_not_dilute_the_score(service):
+    analysis = service.analyze_ingredients_fallback(
+        "enriched flour (wheat flour, niacin), sodium nitrite", UserPreferences()
+    )
+    assert [i.ingredient for i in analysis.ingredients] == ["Wheat Flour", "Niacin", "Sodium Nitrite"]
+    assert (analysis.overall_score, analysis.recommendation) == (69, "neutral")
+
+
+def test_sub_ingredients_inherit_group_concerns_once(service):
+    analysis = service.analyze_ingredients_fallback(
+        "red 40 lake (aluminum hydroxide, water), cheese (cultures, salt)",
+        UserPreferences(allergens=["milk"], dietary_restrictions=["vegan"]),
+    )
+    by_name = {i.ingredient: i for i in analysis.ingredients}
+    assert by_name["Aluminum Hydroxide"].harmful_score == by_name["Water"].harmful_score > 0
+    assert by_name["Cultures"].is_allergen and by_name["Salt"].is_allergen
+    assert [c for c in analysis.concerns if not c.startswith("Contains multiple")] == [
+        "Red 40 Lake: Linked to hyperactivity, allergic reactions",
+        "ALLERGEN WARNING: Contains Milk",
+        "DIETARY CONFLICT: Cheese is not vegan",
+    ]
+
+
+def test_harmful_entries_are_not_rewritten_away(service):
+    assert [name for name in service.harmful_ingredients if canonicalize(name).key != name] == []
+    analysis = service.analyze_ingredients_fallback("msg", UserPreferences())
+    assert analysis.concerns[0] == "Msg: Headaches in sensitive individuals"
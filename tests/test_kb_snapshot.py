@@ -0,0 +1,161 @@
+import struct
+
+import pytest
+
+from kb_snapshot import (
+    FLAG_PREFIX,
+    FLAG_TRAIT,
+    KIND_DELTA,
+    MAGIC,
+    KnowledgeEntry,
+    _HEADER,
+    _decode_body,
+    aliases_from_parser,
+    build_delta,
+    build_snapshot,
+    decode_snapshot,
+    entries_from_service,
+)
+from server import AIAnalysisService
+
+ENTRIES = {
+    "bht": KnowledgeEntry(90, 0, 0, "Potential carcinogen"),
+    "milk": KnowledgeEntry(0, 1, 16, "", FLAG_TRAIT | FLAG_PREFIX),
+    "crème fraîche": KnowledgeEntry(0, 1, 16, "", FLAG_TRAIT | FLAG_PREFIX),
+    "sodium nitrite": KnowledgeEntry(95, 0, 0, "Forms nitrosamines"),
+}
+ALIASES = {"e250": "sodium nitrite", "msg": "monosodium glutamate"}
+
+
+def read_names(data, offset):
+    (count,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    names = []
+    for _ in range(count):
+        length = data[offset]
+        names.append(data[offset + 1:offset + 1 + length].decode("utf-8"))
+        offset += 1 + length
+    return names, offset
+
+
+def decode_delta(data):
+    magic, _, kind, base, target = _HEADER.unpack_from(data, 0)
+    assert (magic, kind) == (MAGIC, KIND_DELTA)
+    changed, changed_aliases, offset = _decode_body(data, _HEADER.size)
+    removed, offset = read_names(data, offset)
+    removed_aliases, offset = read_names(data, offset)
+    assert offset == len(data)
+    return base.hex(), target.hex(), changed, removed, changed_aliases, removed_aliases
+
+
+def test_snapshot_round_trip():
+    snapshot = build_snapshot(ENTRIES, ALIASES)
+    decoded = decode_snapshot(snapshot.data)
+    assert decoded.version == snapshot.version
+    assert decoded.entries == ENTRIES
+    assert decoded.aliases == ALIASES
+    assert len(snapshot.version) == 16
+
+
+def test_version_is_a_content_hash():
+    assert build_snapshot(dict(reversed(list(ENTRIES.items())))).version == build_snapshot(ENTRIES).version
+    changed = {**ENTRIES, "bht": KnowledgeEntry(91, 0, 0, "Potential carcinogen")}
+    assert build_snapshot(changed).version != build_snapshot(ENTRIES).version
+
+
+def test_delta_contains_only_changes_and_removals():
+    base = build_snapshot(ENTRIES)
+    target_entries = {k: v for k, v in ENTRIES.items() if k != "milk"}
+    target_entries["bht"] = KnowledgeEntry(92, 0, 0, "Potential carcinogen")
+    target_entries["tbhq"] = KnowledgeEntry(88, 0, 0, "Vision disturbances")
+    target = build_snapshot(target_entries)
+
+    base_version, target_version, changed, removed, _, _ = decode_delta(build_delta(base, target))
+
+    assert (base_version, target_version) == (base.version, target.version)
+    assert changed == {"bht": target_entries["bht"], "tbhq": target_entries["tbhq"]}
+    assert removed == ["milk"]
+
+
+def test_delta_carries_alias_changes():
+    base = build_snapshot(ENTRIES, ALIASES)
+    target = build_snapshot(ENTRIES, {"e250": "sodium nitrite", "e321": "bht"})
+    assert build_snapshot(ENTRIES, ALIASES).version != target.version
+
+    _, _, changed, removed, changed_aliases, removed_aliases = decode_delta(build_delta(base, target))
+
+    assert (changed, removed) == ({}, [])
+    assert changed_aliases == {"e321": "bht"}
+    assert removed_aliases == ["msg"]
+
+
+def test_decode_rejects_deltas():
+    snapshot = build_snapshot(ENTRIES)
+    with pytest.raises(ValueError):
+        decode_snapshot(build_delta(snapshot, snapshot))
+
+
+def test_service_entries_survive_round_trip():
+    entries = entries_from_service(AIAnalysisService())
+    aliases = aliases_from_parser()
+    decoded = decode_snapshot(build_snapshot(entries, aliases).data)
+    assert decoded.entries == entries
+    assert decoded.aliases == aliases
+
+
+def test_service_entries_say_how_terms_match():
+    entries = entries_from_service(AIAnalysisService())
+    # Allergen terms and exclusions match as word prefixes, diet-only terms as whole words
+    assert entries["milk"].flags == FLAG_TRAIT | FLAG_PREFIX
+    assert entries["coconut milk"].flags == FLAG_TRAIT | FLAG_PREFIX
+    assert entries["ham"].flags == FLAG_TRAIT
+    assert entries["bht"].flags == 0
+
+    aliases = aliases_from_parser()
+    assert aliases["e129"] == aliases["red 40"] == "red dye 40"
+
+
+def test_snapshot_route_revalidates(client):
+    response = client.get("/api/kb/snapshot")
+    assert response.status_code == 200
+    assert decode_snapshot(response.content).version == response.headers["x-kb-version"]
+    cached = client.get("/api/kb/snapshot", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+def test_snapshot_etag_is_weak_across_content_codings(client):
+    gzipped = client.get("/api/kb/snapshot", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/api/kb/snapshot", headers={"Accept-Encoding": "identity"})
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert "content-encoding" not in identity.headers
+    assert gzipped.headers["etag"].startswith("W/")
+    assert identity.headers["etag"].startswith("W/")
+
+
+MALFORMED_VERSIONS = ("not-a-version", "0123456789abcdeg", "0123456789abcdef0", "%0d%0aX-Injected:%201", "%22q%22")
+
+
+def test_delta_route_rejects_malformed_versions(client):
+    # "*" would otherwise answer 304 with the path parameter in the ETag
+    for base_version in MALFORMED_VERSIONS:
+        response = client.get(f"/api/kb/delta/{base_version}", headers={"If-None-Match": "*"})
+        assert response.status_code == 404
+        assert "etag" not in response.headers
+
+
+def test_delta_route_unknown_and_current_version(client, app):
+    assert client.get("/api/kb/delta/0123456789abcdef").status_code == 404
+    assert client.get("/api/kb/delta/0123456789abcdef", headers={"If-None-Match": "*"}).status_code == 404
+    current = app.state.kb_snapshot.version
+    response = client.get(f"/api/kb/delta/{current}")
+    assert response.status_code == 200
+    _, _, changed, removed, changed_aliases, removed_aliases = decode_delta(response.content)
+    assert changed == {} and removed == []
+    assert changed_aliases == {} and removed_aliases == []
+
+
+def test_delta_route_from_older_format_is_unknown(client, database):
+    stored = bytearray(build_snapshot(ENTRIES).data)
+    stored[4] = 1  # format byte
+    client.portal.call(database.kb_snapshots.insert_one, {"_id": "00000000000000aa", "data": bytes(stored)})
+    assert client.get("/api/kb/delta/00000000000000aa").status_code == 404
@@ -0,0 +1,20 @@
+import pytest
+
+from backend_load_test import percentile
+
+
+@pytest.mark.parametrize("values, pct, expected", [
+    (range(1, 11), 50, 5),
+    (range(1, 7), 50, 3),
+    (range(1, 21), 95, 19),
+    (range(1, 21), 99, 20),
+    (range(1, 11), 0, 1),
+    (range(1, 11), 100, 10),
+    ([7], 99, 7),
+])
+def test_percentile_uses_nearest_rank(values, pct, expected):
+    assert percentile(list(values), pct) == expected
+
+
+def test_percentile_of_no_samples():
+    assert percentile([], 50) is None
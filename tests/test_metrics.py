@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+from metrics import ANALYSIS_TOTAL, Counter, Histogram
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(metrics.__file__))
+
+WORKER = """
+import metrics
+metrics.ANALYSIS_TOTAL.inc(("fallback",), 3)
+metrics.STAGE_LATENCY.observe(0.002, ("analysis",))
+metrics.write_snapshot()
+"""
+
+
+def sample_value(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_duration_seconds", "Test", ("stage",), buckets=(0.1, 1.0))
+    metrics.REGISTRY.remove(histogram)
+    histogram.observe(0.05, ("a",))
+    histogram.observe(0.5, ("a",))
+    lines = list(histogram.collect())
+    assert 'test_duration_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'test_duration_seconds_bucket{stage="a",le="+Inf"} 2' in lines
+    assert 'test_duration_seconds_count{stage="a"} 2' in lines
+
+
+def test_merge_sums_counter_and_histogram_state():
+    counters = {}
+    Counter.merge(counters, ("x",), 2)
+    Counter.merge(counters, ("x",), 3)
+    assert counters == {("x",): 5}
+
+    histograms = {}
+    Histogram.merge(histograms, ("x",), [[1, 0], 0.1, 1])
+    Histogram.merge(histograms, ("x",), [[0, 2], 3.0, 2])
+    assert histograms == {("x",): [[1, 2], 3.1, 3]}
+
+
+def test_multiprocess_scrape_sums_all_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "MULTIPROC_DIR", str(tmp_path))
+    env = {**os.environ, "METRICS_MULTIPROC_DIR": str(tmp_path), "PYTHONPATH": BACKEND_DIR}
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", WORKER], env=env, check=True)
+
+    local = ANALYSIS_TOTAL._values.get(("fallback",), 0)
+    text = metrics.render_latest()
+
+    assert len(list(tmp_path.glob("*.json"))) == 3
+    assert sample_value(text, 'ingredient_analysis_total{engine="fallback"}') == local + 6
+    assert sample_value(text, 'stage_duration_seconds_count{stage="analysis"}') >= 2
+
+
+def test_reset_multiprocess_dir_clears_previous_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "MULTIPROC_DIR", str(tmp_path))
+    (tmp_path / "12345.json").write_text("{}")
+    metrics.reset_multiprocess_dir()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_timing_logs_emit_json_lines(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "TIMING_LOGS", True)
+    monkeypatch.setattr(metrics.logger, "handlers", [])
+    level = metrics.logger.level
+    metrics.configure_timing_logs()
+    try:
+        with metrics.span("test_stage"):
+            pass
+    finally:
+        metrics.logger.setLevel(level)
+
+    records = [json.loads(r.getMessage()) for r in caplog.records if r.name == metrics.logger.name]
+    assert [r["stage"] for r in records] == ["test_stage"]
+    assert records[0]["error"] is None and records[0]["duration_ms"] >= 0
+
+
+def test_timing_logs_flag_prints_to_stderr():
+    code = "import metrics\nwith metrics.span('x'):\n    pass\n"
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True,
+                            env={**os.environ, "TIMING_LOGS": "1"}, check=True)
+    assert json.loads(result.stderr)["stage"] == "x"
@@ -0,0 +1,69 @@
+import pytest
+
+from personalization import Allergen, DietFlag, allergen_names, compile_preferences
+from server import AIAnalysisService, UserPreferences
+
+
+@pytest.fixture(scope="module")
+def service():
+    return AIAnalysisService()
+
+
+def allergen_flags(service, text, **preferences):
+    analysis = service.analyze_ingredients_fallback(text, UserPreferences(**preferences))
+    return {i.ingredient.lower(): i.is_allergen for i in analysis.ingredients}
+
+
+def test_compile_preferences_normalizes_labels_and_ors_masks():
+    profile = compile_preferences(UserPreferences(
+        allergens=["Milk", "tree nuts", "unknown"],
+        dietary_restrictions=["Gluten Free", "vegan"],
+        health_goals=["low_sugar"],
+    ))
+    assert profile.allergens == Allergen.MILK | Allergen.TREE_NUTS
+    assert profile.diet_allergens == 0
+    assert profile.restrictions & DietFlag.GLUTEN
+    assert profile.restrictions & DietFlag.DAIRY
+    assert profile.goals == DietFlag.ADDED_SUGAR
+    assert profile.restriction_conflicts(int(DietFlag.GLUTEN)) == ["Gluten Free"]
+    assert profile.goal_conflicts(int(DietFlag.ADDED_SUGAR)) == ["low_sugar"]
+
+
+def test_compile_preferences_shares_identical_profiles():
+    first = compile_preferences(UserPreferences(allergens=["soy"]))
+    assert compile_preferences(UserPreferences(allergens=["soy"])) is first
+
+
+def test_gluten_allergy_resolves_to_diet_flag():
+    profile = compile_preferences(UserPreferences(allergens=["gluten"]))
+    assert profile.allergens == 0
+    assert profile.diet_allergens == DietFlag.GLUTEN
+
+
+def test_allergen_names():
+    assert allergen_names(int(Allergen.MILK | Allergen.SOY)) == ["milk", "soy"]
+    assert allergen_names(0, int(DietFlag.GLUTEN)) == ["gluten"]
+
+
+def test_milk_compounds_are_allergens(service):
+    flags = allergen_flags(service, "buttermilk, milkfat, sodium caseinate, milk solids, ghee", allergens=["milk"])
+    assert all(flags.values()), flags
+
+
+def test_milk_look_alikes_are_not_allergens(service):
+    flags = allergen_flags(service, "cocoa butter, coconut milk, oat milk, butternut squash, cream of tartar",
+                           allergens=["milk"])
+    assert not any(flags.values()), flags
+
+
+def test_gluten_allergy_flags_barley_rye_and_malt(service):
+    flags = allergen_flags(service, "barley malt, rye flour, malted wheat, maltitol", allergens=["gluten"])
+    assert flags == {"barley malt": True, "rye flour": True, "malted wheat": True, "maltitol": False}
+
+
+def test_diet_terms_match_whole_words(service):
+    analysis = service.analyze_ingredients_fallback(
+        "ham, hamburger buns", UserPreferences(dietary_restrictions=["vegetarian"])
+    )
+    conflicts = [c for c in analysis.concerns if c.startswith("DIETARY CONFLICT")]
+    assert conflicts == ["DIETARY CONFLICT: Ham is not vegetarian"]
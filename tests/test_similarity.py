@@ -0,0 +1,124 @@
+import asyncio
+
+from server import warm_similarity_index
+from similarity import ProductSimilarityIndex, product_id_for
+
+
+def add(index, ingredients, score, text=None):
+    return index.add(frozenset(ingredients), score, "neutral", text or ", ".join(ingredients))
+
+
+def test_product_id_ignores_ingredient_order():
+    assert product_id_for(["salt", "water"]) == product_id_for(["water", "salt"])
+
+
+def test_top_k_ranks_by_similarity_above_min_score():
+    index = ProductSimilarityIndex()
+    query = add(index, ["oats", "sugar", "palm oil", "bht"], 40)
+    close = add(index, ["oats", "sugar", "palm oil"], 80)
+    far = add(index, ["oats", "honey"], 90)
+    add(index, ["oats", "sugar", "palm oil", "bht", "salt"], 30)
+    add(index, ["rice", "water"], 95)
+
+    matches = index.similar(query.ingredients, min_score=query.overall_score, k=5, exclude=query.product_id)
+
+    assert [product for _, product in matches] == [close, far]
+    assert matches[0][0] > matches[1][0]
+
+
+def test_k_limits_results():
+    index = ProductSimilarityIndex()
+    for i in range(10):
+        add(index, ["oats", f"extra {i}"], 50 + i)
+    assert len(index.similar(frozenset(["oats"]), min_score=0, k=3)) == 3
+
+
+def test_low_scoring_products_do_not_use_up_candidate_budget():
+    index = ProductSimilarityIndex(max_candidates=2000)
+    for i in range(10000):
+        add(index, ["whey", f"filler {i}"], 10)
+    qualifying = {add(index, ["whey", f"good {i}"], 90).product_id for i in range(5)}
+
+    matches = index.similar(frozenset(["whey", "sugar"]), min_score=50, k=10)
+
+    assert {product.product_id for _, product in matches} == qualifying
+
+
+def test_add_refreshes_existing_product():
+    index = ProductSimilarityIndex()
+    first = add(index, ["oats", "sugar"], 40)
+    second = add(index, ["sugar", "oats"], 70)
+    assert second is first
+    assert len(index) == 1
+    assert index.get(first.product_id).overall_score == 70
+
+
+def test_alternatives_route_does_not_roll_back_newer_analysis(client, user_id, app, database):
+    scan_id = client.post("/api/sync", json={"user_id": user_id, "scans": [
+        {"idempotency_key": "a", "ingredients_text": "oats, sugar"},
+    ]}).json()["results"][0]["scan_id"]
+    index = app.state.similarity_index
+    product_id = product_id_for(["oats", "sugar"])
+    original_score = index.get(product_id).overall_score
+
+    # A newer analysis of the same product, e.g. from an updated knowledge base
+    add(index, ["oats", "sugar"], original_score - 30)
+
+    response = client.get(f"/api/scans/{scan_id}/alternatives")
+    assert response.status_code == 200
+    assert response.json()["overall_score"] == original_score - 30
+    assert index.get(product_id).overall_score == original_score - 30
+
+
+def test_warm_up_keeps_latest_analysis_per_product(database):
+    async def seed_and_warm():
+        for created_at, score in [("2026-01-01T00:00:00", 30), ("2026-02-01T00:00:00", 75)]:
+            await database.scans.insert_one({
+                "user_id": "u",
+                "ingredients_text": "Sugar, Oats",
+                "analysis": {"overall_score": score, "recommendation": "neutral"},
+                "created_at": created_at,
+            })
+        await database.scans.insert_one({
+            "user_id": "u",
+            "ingredients_text": "rice, water",
+            "analysis": {"overall_score": 90, "recommendation": "recommended"},
+            "created_at": "2026-01-15T00:00:00",
+        })
+        index = ProductSimilarityIndex()
+        await warm_similarity_index(database, index)
+        return index
+
+    index = asyncio.run(seed_and_warm())
+    assert len(index) == 2
+    assert index.get(product_id_for(["oats", "sugar"])).overall_score == 75
+
+
+class CountingDict(dict):
+    lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super().__getitem__(key)
+
+
+def test_query_few_products_beat_stops_at_common_postings():
+    index = ProductSimilarityIndex(max_posting_length=1000, max_scanned=500)
+    for i in range(5000):
+        add(index, ["water", "salt", "sugar", f"filler {i // 4}"], 50)
+    query = add(index, ["water", "salt", "sugar", "saffron"], 95)
+    index._products = CountingDict(index._products)
+
+    assert index.similar(query.ingredients, min_score=query.overall_score, exclude=query.product_id) == []
+    # Only the rare "saffron" posting was walked; water/salt/sugar were not
+    assert index._products.lookups <= 1
+
+
+def test_scanned_entries_are_capped():
+    index = ProductSimilarityIndex(max_scanned=300)
+    for i in range(2000):
+        add(index, ["oats", f"filler {i}"], 10)
+    index._products = CountingDict(index._products)
+
+    assert index.similar(frozenset(["oats"]), min_score=50) == []
+    assert index._products.lookups <= 300
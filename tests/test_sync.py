@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import server
+from server import FREE_DAILY_SCAN_LIMIT, SYNC_GAP_TIMEOUT, allocate_scan_versions
+
+
+def queued(*keys):
+    return [{"idempotency_key": key, "ingredients_text": f"water, salt, {key}"} for key in keys]
+
+
+def sync(client, user_id, scans=(), cursor=None):
+    response = client.post("/api/sync", json={"user_id": user_id, "scans": list(scans), "cursor": cursor})
+    assert response.status_code == 200
+    return response.json()
+
+
+def statuses(body):
+    return {result["idempotency_key"]: result["status"] for result in body["results"]}
+
+
+def test_retried_batch_is_recorded_once(client, user_id):
+    first = sync(client, user_id, queued("a", "b"))
+    assert statuses(first) == {"a": "created", "b": "created"}
+
+    retry = sync(client, user_id, queued("a", "b"))
+    assert statuses(retry) == {"a": "duplicate", "b": "duplicate"}
+    assert [r["scan_id"] for r in retry["results"]] == [r["scan_id"] for r in first["results"]]
+
+    assert len(client.get(f"/api/users/{user_id}/scans").json()) == 2
+    assert client.get(f"/api/users/{user_id}").json()["scans_today"] == 2
+
+
+def test_free_user_daily_limit(client, user_id):
+    keys = [f"k{i}" for i in range(FREE_DAILY_SCAN_LIMIT + 2)]
+    body = sync(client, user_id, queued(*keys))
+
+    results = statuses(body)
+    assert list(results.values()).count("created") == FREE_DAILY_SCAN_LIMIT
+    assert [results[k] for k in keys[FREE_DAILY_SCAN_LIMIT:]] == ["limit_reached", "limit_reached"]
+    assert statuses(sync(client, user_id, queued("late"))) == {"late": "limit_reached"}
+
+
+def test_cursor_returns_only_newer_changes(client, user_id):
+    first = sync(client, user_id, queued("a", "b"))
+    assert len(first["changes"]) == 2
+    assert first["cursor"] == 2
+    assert first["has_more"] is False
+
+    assert sync(client, user_id, cursor=first["cursor"])["changes"] == []
+
+    second = sync(client, user_id, queued("c"), cursor=first["cursor"])
+    assert [change["idempotency_key"] for change in second["changes"]] == ["c"]
+    assert second["cursor"] == 3
+
+
+def test_cursor_pages_through_history(client, user_id, monkeypatch):
+    monkeypatch.setattr(server, "SYNC_MAX_CHANGES", 2)
+    sync(client, user_id, queued("a", "b", "c"))
+
+    page = sync(client, user_id)
+    assert page["has_more"] is True
+    seen = [c["idempotency_key"] for c in page["changes"]]
+    page = sync(client, user_id, cursor=page["cursor"])
+    seen += [c["idempotency_key"] for c in page["changes"]]
+    assert page["has_more"] is False
+    assert sorted(seen) == ["a", "b", "c"]
+
+
+def test_cursor_stays_behind_scan_still_being_written(client, user_id, database):
+    sync(client, user_id, queued("a"))
+    # Another request has reserved version 2 but not inserted its scan yet
+    (in_flight,) = client.portal.call(allocate_scan_versions, database, user_id, 1)
+    body = sync(client, user_id, queued("b"), cursor=1)
+
+    assert [c["version"] for c in body["changes"]] == [3]
+    assert body["cursor"] == 1
+    assert body["has_more"] is False
+
+    client.portal.call(database.scans.insert_one, {
+        "user_id": user_id, "ingredients_text": "late", "created_at": datetime.utcnow().isoformat(),
+        "version": in_flight, "versioned_at": datetime.utcnow().isoformat(),
+    })
+    body = sync(client, user_id, cursor=body["cursor"])
+    assert [c["version"] for c in body["changes"]] == [2, 3]
+    assert body["cursor"] == 3
+
+
+def test_abandoned_gap_is_skipped_after_timeout(client, user_id, database):
+    client.portal.call(allocate_scan_versions, database, user_id, 1)
+    sync(client, user_id, queued("a"))
+    stale = (datetime.utcnow() - timedelta(seconds=SYNC_GAP_TIMEOUT + 1)).isoformat()
+    client.portal.call(database.scans.update_many, {"user_id": user_id}, {"$set": {"versioned_at": stale}})
+
+    assert sync(client, user_id)["cursor"] == 2
+
+
+def test_failed_insert_keeps_other_scans(client, user_id, database, monkeypatch, caplog):
+    insert_one = database.scans.insert_one
+
+    async def flaky_insert(document):
+        if document.get("idempotency_key") == "bad":
+            raise ConnectionError("write failed")
+        return await insert_one(document)
+
+    monkeypatch.setattr(database.scans, "insert_one", flaky_insert)
+    body = sync(client, user_id, queued("a", "bad", "c"))
+    assert statuses(body) == {"a": "created", "bad": "failed", "c": "created"}
+    assert client.get(f"/api/users/{user_id}").json()["scans_today"] == 2
+    assert {c["idempotency_key"] for c in body["changes"]} == {"a", "c"}
+    assert [r.getMessage() for r in caplog.records if r.name == "grocery_detective"] == ["Sync scan bad failed"]
+
+    monkeypatch.setattr(database.scans, "insert_one", insert_one)
+    assert statuses(sync(client, user_id, queued("a", "bad"))) == {"a": "duplicate", "bad": "created"}
+
+
+def test_first_sync_includes_scans_from_before_sync(client, user_id, database):
+    for day in (1, 2):
+        client.portal.call(database.scans.insert_one, {
+            "_id": ObjectId(), "user_id": user_id, "ingredients_text": f"legacy {day}",
+            "created_at": f"2026-01-0{day}T00:00:00",
+        })
+
+    body = sync(client, user_id)
+    assert [c["ingredients_text"] for c in body["changes"]] == ["legacy 1", "legacy 2"]
+    assert body["cursor"] == 2
+    assert sync(client, user_id, cursor=body["cursor"])["changes"] == []
+
+
+def test_unknown_user_is_not_found_without_scans(client):
+    response = client.post("/api/sync", json={"user_id": str(ObjectId()), "scans": []})
+    assert response.status_code == 404
+
+
+def test_rejects_oversized_batch(client, user_id):
+    keys = [f"k{i}" for i in range(server.SYNC_MAX_BATCH + 1)]
+    response = client.post("/api/sync", json={"user_id": user_id, "scans": queued(*keys)})
+    assert response.status_code == 413